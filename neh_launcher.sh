@@ -0,0 +1,7 @@
+#!/bin/bash
+launcher="$(realpath $0)"
+launcher_dir="$(dirname ${launcher})"
+
+cd ${launcher_dir}
+
+./launcher.sh opcpa_tpr_config/neh_bay2_config.yaml opcpa_tpr_config/neh_bay3_config.yaml
@@ -0,0 +1,89 @@
+"""
+Loading and validation of the application configuration file.
+"""
+from types import MappingProxyType
+
+import yaml
+
+# Keys every config file needs in its "main" section
+REQUIRED_MAIN_KEYS = [
+    'xpm_pv',
+    'meta_pv',
+    'notepad_pv',
+    'engine1',
+    'engine2',
+    'title',
+    'bay',
+    'laser_database',
+    'devices',
+]
+
+
+def read_config(config_file):
+    """
+    Read in the config file for the screen.
+    """
+    with open(config_file, "r") as f:
+        conf = yaml.safe_load(f)
+    return conf
+
+
+def freeze(obj):
+    """
+    Return a read-only copy of a parsed YAML structure: dicts become
+    MappingProxyType views of a private copy and lists become tuples.
+    """
+    if isinstance(obj, dict):
+        return MappingProxyType({k: freeze(v) for k, v in obj.items()})
+    if isinstance(obj, list):
+        return tuple(freeze(v) for v in obj)
+    return obj
+
+
+def validate_config(conf, config_file=""):
+    """
+    Check that a parsed config has everything the displays rely on.
+    """
+    if not isinstance(conf, dict) or not isinstance(conf.get('main'), dict):
+        raise ValueError(f"Config file {config_file} has no 'main' section")
+
+    missing = [key for key in REQUIRED_MAIN_KEYS if key not in conf['main']]
+    if missing:
+        raise ValueError(
+            f"Config file {config_file} is missing main keys: {missing}"
+        )
+
+    rate = conf['main'].get('expert_refresh_rate')
+    if rate is not None:
+        try:
+            valid = float(rate) > 0
+        except (TypeError, ValueError):
+            valid = False
+        if not valid:
+            raise ValueError(
+                f"expert_refresh_rate in {config_file} must be a positive "
+                f"number, got {rate!r}"
+            )
+
+    cfgs = conf.get('goose_arrival_configs')
+    if cfgs is not None:
+        for name, cfg in cfgs.items():
+            if not isinstance(cfg, dict) or 'desc' not in cfg:
+                raise ValueError(
+                    f"Goose arrival config {name} in {config_file} has no "
+                    f"'desc'"
+                )
+
+
+def load_config(config_file):
+    """
+    Read, validate and freeze the config file. The result is meant to be
+    built once at startup and shared by every display.
+    """
+    conf = read_config(config_file)
+    if conf is None:
+        raise ValueError(f"Could not read config file {config_file}")
+
+    validate_config(conf, config_file)
+
+    return freeze(conf)
@@ -0,0 +1,30 @@
+"""
+Atomic replacement of files read by other processes.
+"""
+import os
+import tempfile
+
+
+def write_atomic(path, text, mode=0o644):
+    """
+    Write a text file through a temporary file in the same directory that is
+    then moved into place, so a reader never sees a partial file.
+
+    Arguments
+    ---------
+    path: Path of the file to write
+    text: Contents of the file
+    mode: Permissions of the file. mkstemp creates the temporary file 0600,
+          which would hide the file from other users.
+    """
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path) or ".",
+                               suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(text)
+        os.chmod(tmp, mode)
+        os.replace(tmp, path)
+    except OSError:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
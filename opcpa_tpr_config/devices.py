@@ -0,0 +1,266 @@
+"""
+Long-lived access to the laser devices described in the happi database.
+"""
+import logging
+import math
+import os
+import threading
+from functools import partial
+
+from parallel import run_concurrently
+
+logger = logging.getLogger(__name__)
+
+
+def setting_signal(device, attr):
+    """
+    Return the signal of a setting. attr is None for devices that are
+    signals themselves.
+    """
+    return device if attr is None else getattr(device, attr)
+
+
+def read_setting(signal, value):
+    """
+    Read a signal in the form the requested value is given in: enum settings
+    requested as strings are read back as strings.
+    """
+    if isinstance(value, str):
+        return signal.get(as_string=True)
+    return signal.get()
+
+
+def try_read_setting(signal, value):
+    """
+    Like read_setting, but return None if the signal can't be read.
+    """
+    try:
+        return read_setting(signal, value)
+    except Exception as e:
+        logger.debug("Could not read %s: %s", signal.name, e)
+        return None
+
+
+def values_match(current, value, tolerance=1e-6):
+    """
+    Compare a read back value with a requested one. Strings must match
+    exactly, numbers within an absolute tolerance. Booleans match their
+    numeric readback, e.g. True and 1.
+    """
+    if current is None:
+        return False
+    if isinstance(value, bool):
+        if isinstance(current, str):
+            return current.strip().lower() in (
+                ("1", "true") if value else ("0", "false")
+            )
+        return bool(current) == value
+    if isinstance(value, str) or isinstance(current, str):
+        return str(current) == str(value)
+    try:
+        return math.isclose(current, value, abs_tol=tolerance)
+    except TypeError:
+        return current == value
+
+
+def write_settings(settings, timer=None):
+    """
+    Write a list of (name, device, attr, value) settings as one concurrent
+    batch with one call per device: configure() for device attributes and
+    put() for devices that are signals. Each device write is timed if an
+    ApplyTimer is given.
+    """
+    puts = {}
+    configs = {}
+    for name, device, attr, value in settings:
+        if attr is None:
+            puts[name] = (device, value)
+        else:
+            configs.setdefault(name, (device, {}))[1][attr] = value
+
+    calls = [
+        (name, partial(device.put, value))
+        for name, (device, value) in puts.items()
+    ]
+    calls += [
+        (name, partial(device.configure, config))
+        for name, (device, config) in configs.items()
+    ]
+    if timer is not None:
+        calls = [
+            (name, timer.timed("device_write", func, name))
+            for name, func in calls
+        ]
+    run_concurrently(calls)
+
+
+class HappiCatalog:
+    """
+    In-memory index of a laser happi database. The JSON backend is read once
+    and indexed by name, device class and active flag; it is only read again
+    when the file's modification time changes (see refresh). generation
+    counts the reloads, so users of the catalog can tell that it changed
+    since they last looked, whoever refreshed it.
+
+    Arguments
+    ---------
+    db_path: Path to the happi JSON database
+    """
+    def __init__(self, db_path):
+        self._path = db_path
+        self._mtime = None
+        self.generation = 0
+        self._by_name = {}
+        self._by_class = {}
+        self.refresh()
+
+    @property
+    def path(self):
+        return self._path
+
+    def refresh(self):
+        """
+        Reload the database if the file changed since it was last read.
+
+        returns:
+            True if the database was (re)loaded
+        """
+        mtime = os.path.getmtime(self._path)
+        if mtime == self._mtime:
+            return False
+
+        import happi
+
+        items = happi.Client(path=self._path).search()
+        by_name = {}
+        by_class = {}
+        for item in items:
+            md = item.metadata
+            by_name[md['name']] = item
+            for key in ((md['device_class'], None),
+                        (md['device_class'], bool(md.get('active')))):
+                by_class.setdefault(key, []).append(item)
+
+        # Swap in complete indexes so readers never see a partial reload
+        self._by_name = by_name
+        self._by_class = by_class
+        self._mtime = mtime
+        self.generation += 1
+
+        return True
+
+    def get(self, name):
+        """
+        Return the happi search result for a device name, or None.
+        """
+        return self._by_name.get(name)
+
+    def search(self, device_class, active=None):
+        """
+        Return the happi search results of a device class, optionally only
+        the active (or inactive) ones.
+        """
+        key = (device_class, None if active is None else bool(active))
+        return list(self._by_class.get(key, ()))
+
+    def __contains__(self, name):
+        return name in self._by_name
+
+    def __len__(self):
+        return len(self._by_name)
+
+
+_catalogs = {}
+_catalogs_lock = threading.Lock()
+
+
+def get_catalog(db_path):
+    """
+    Return the shared HappiCatalog for a database path, creating it on first
+    use and refreshing it if the file changed.
+    """
+    key = os.path.realpath(db_path)
+    with _catalogs_lock:
+        catalog = _catalogs.get(key)
+        if catalog is None:
+            catalog = HappiCatalog(db_path)
+            _catalogs[key] = catalog
+        else:
+            catalog.refresh()
+    return catalog
+
+
+class DevicePool:
+    """
+    Pool of ophyd devices instantiated from happi items. Each item is
+    instantiated and connected once, the same object is handed out on every
+    later request.
+
+    Arguments
+    ---------
+    timeout: Seconds to wait for a new device to connect
+    """
+    def __init__(self, timeout=5.0):
+        self._timeout = timeout
+        self._devices = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+        self._generation = None
+
+    def get(self, item):
+        """
+        Return the device for a happi search result, instantiating and
+        connecting it on first use. Safe to call from several threads.
+        """
+        name = item.metadata['name']
+        device = self._devices.get(name)
+        if device is not None:
+            return device
+
+        with self._lock:
+            lock = self._locks.setdefault(name, threading.Lock())
+
+        # Only one thread builds a given device, others wait for it
+        with lock:
+            device = self._devices.get(name)
+            if device is None:
+                device = item.get()
+                try:
+                    device.wait_for_connection(timeout=self._timeout)
+                except TimeoutError:
+                    logger.warning("%s did not connect within %s s", name,
+                                   self._timeout)
+                self._devices[name] = device
+
+        return device
+
+    def clear(self):
+        """
+        Forget all pooled devices, e.g. after the happi database changed.
+        """
+        with self._lock:
+            self._devices.clear()
+            self._locks.clear()
+
+    def sync(self, catalog):
+        """
+        Forget all pooled devices if the catalog was reloaded since the last
+        sync, as devices built from the old entries may no longer match them.
+
+        returns:
+            True if the pool was cleared
+        """
+        generation = catalog.generation
+        if generation == self._generation:
+            return False
+        cleared = self._generation is not None
+        if cleared:
+            self.clear()
+        self._generation = generation
+        return cleared
+
+    def __contains__(self, name):
+        return name in self._devices
+
+    def __len__(self):
+        return len(self._devices)
@@ -0,0 +1,67 @@
+"""
+Helpers for running independent EPICS operations concurrently.
+"""
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# Bound on simultaneous IOC round-trips from a single batch
+MAX_WORKERS = 8
+
+
+class BatchError(RuntimeError):
+    """
+    Raised by run_concurrently when calls of a batch failed.
+
+    Arguments
+    ---------
+    failed: List of the names of the calls that failed
+    results: Dict of name --> return value of the calls that succeeded
+    message: Error message
+    """
+    def __init__(self, failed, results, message):
+        super().__init__(message)
+        self.failed = failed
+        self.results = results
+
+
+def run_concurrently(calls, max_workers=MAX_WORKERS):
+    """
+    Run a batch of independent calls on a bounded worker pool and wait for
+    all of them to finish.
+
+    Arguments
+    ---------
+    calls: List of (name, function) pairs. Each function takes no arguments.
+    max_workers: Maximum number of calls running at the same time
+
+    returns:
+        Dict of name --> return value
+
+    raises:
+        BatchError listing every call that failed, once all calls are done
+    """
+    if not calls:
+        return {}
+
+    workers = max(1, min(int(max_workers), len(calls)))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [(name, pool.submit(func)) for name, func in calls]
+
+    results = {}
+    failed = []
+    errors = []
+    for name, future in futures:
+        exc = future.exception()
+        if exc is not None:
+            logger.error("%s failed: %s", name, exc)
+            failed.append(name)
+            errors.append(f"{name} ({exc})")
+        else:
+            results[name] = future.result()
+
+    if failed:
+        raise BatchError(failed, results, f"Failed: {', '.join(errors)}")
+
+    return results
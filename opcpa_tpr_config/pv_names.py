@@ -0,0 +1,171 @@
+"""
+Resolve the PV names of happi device signals without instantiating devices.
+
+The PV of a signal is worked out from the happi item's args and kwargs and
+the component layout of its device class. Classes whose components are
+formatted from instance attributes set in __init__ need a namespace builder
+that works those attributes out the same way (see NAMESPACE_BUILDERS).
+Anything that can't be resolved this way falls back to instantiating the
+device. Results are cached.
+"""
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+def _simple_signals():
+    """
+    Signal classes whose pvname is the component suffix.
+    """
+    from ophyd.signal import EpicsSignal, EpicsSignalRO
+
+    return (EpicsSignal, EpicsSignalRO)
+
+
+def tpr_trigger_namespace(prefix, channel, timing_mode=2, **kwargs):
+    """
+    Return the attributes pcdsdevices.tpr.TprTrigger.__init__ sets for its
+    formatted components.
+    """
+    timing_mode = getattr(timing_mode, "value", timing_mode)
+    sys = {1: "SYS0_", 2: "SYS2_", "LCLS1": "SYS0_", "LCLS2": "SYS2_"}
+    return {
+        "prefix": prefix,
+        "ch": f":CH{int(channel):02}_",
+        "trg": f":TRG{int(channel):02}_",
+        "sys": sys[timing_mode],
+    }
+
+
+# device_class --> function of the device args and kwargs returning the
+# attributes used by the class's formatted components
+NAMESPACE_BUILDERS = {
+    "pcdsdevices.tpr.TprTrigger": tpr_trigger_namespace,
+}
+
+
+class _Namespace:
+    """
+    Stand-in for the device instance in FormattedComponent suffixes.
+    """
+    def __init__(self, attrs):
+        self.__dict__.update(attrs)
+
+
+def _item_arguments(item):
+    """
+    Return the args and kwargs happi would instantiate an item with.
+    """
+    from happi.loader import fill_template
+
+    happi_item = getattr(item, "item", item)
+    args = [fill_template(arg, happi_item, enforce_type=True)
+            if isinstance(arg, str) else arg
+            for arg in happi_item.args]
+    kwargs = {key: fill_template(value, happi_item, enforce_type=True)
+              if isinstance(value, str) else value
+              for key, value in happi_item.kwargs.items()}
+    return args, kwargs
+
+
+def _signal_pvname(device_class, args, kwargs):
+    if not issubclass(device_class, _simple_signals()):
+        return None
+    if args:
+        return args[0]
+    return kwargs.get("read_pv")
+
+
+def _component_pvname(device_class_name, device_class, attr, args, kwargs):
+    from ophyd.device import Component, FormattedComponent
+
+    if "." in attr:
+        return None  # Nested devices are left to the fallback
+    cpt = getattr(device_class, attr, None)
+    if not isinstance(cpt, Component) or cpt.cls not in _simple_signals():
+        return None
+    prefix = args[0] if args else kwargs.get("prefix", "")
+
+    if isinstance(cpt, FormattedComponent):
+        builder = NAMESPACE_BUILDERS.get(device_class_name)
+        if builder is None:
+            return None
+        attrs = builder(*args, **kwargs)
+        return cpt.suffix.format(self=_Namespace(attrs), **attrs)
+
+    return f"{prefix}{cpt.suffix}"
+
+
+def resolve_pvname(item, attr):
+    """
+    Work out a signal PV name from happi metadata.
+
+    Arguments
+    ---------
+    item: happi Client search result
+    attr: Signal attribute of the device, or None for devices that are
+          signals themselves
+
+    returns:
+        PV name, or None if it can't be worked out without the device
+    """
+    from happi.loader import import_class
+
+    device_class_name = item.metadata["device_class"]
+    try:
+        device_class = import_class(device_class_name)
+        args, kwargs = _item_arguments(item)
+        if attr is None:
+            return _signal_pvname(device_class, args, kwargs)
+        return _component_pvname(
+            device_class_name, device_class, attr, args, kwargs
+        )
+    except Exception as e:
+        logger.debug("Could not resolve %s %s: %s",
+                     item.metadata["name"], attr, e)
+        return None
+
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def _cache_key(item, attr):
+    md = item.metadata
+    return (md["name"], md["device_class"], repr(md.get("args")),
+            repr(sorted(md.get("kwargs", {}).items())), attr)
+
+
+def get_pvname(item, attr, get_device=None):
+    """
+    Return the PV name of a device signal, resolving it from the happi
+    metadata if possible and from the instantiated device otherwise.
+
+    Arguments
+    ---------
+    item: happi Client search result
+    attr: Signal attribute of the device, or None for devices that are
+          signals themselves
+    get_device: Optional function returning the device of a happi item,
+                defaults to item.get
+    """
+    key = _cache_key(item, attr)
+    with _cache_lock:
+        if key in _cache:
+            return _cache[key]
+
+    pvname = resolve_pvname(item, attr)
+    if pvname is None:
+        logger.debug("Instantiating %s to find the %s PV",
+                     item.metadata["name"], attr)
+        device = (get_device or (lambda item: item.get()))(item)
+        if attr is None:
+            pvname = device.pvname
+        else:
+            pvname = getattr(device, f"{attr}.pvname")
+
+    with _cache_lock:
+        _cache[key] = pvname
+
+    return pvname
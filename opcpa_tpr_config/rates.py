@@ -0,0 +1,64 @@
+"""
+Laser rate math. Uses only the standard library, so the allowed rates can be
+listed without psdaq, EPICS, Qt or happi.
+"""
+from collections import Counter
+
+factors = [2, 2, 2, 2, 5, 5, 5, 5, 7, 13]  # 910,000
+carbide_factors = [1, 2, 2, 5, 5, 5, 5, 13]  # 32,500 (remove 2, 2, 7, add 1)
+
+
+def make_base_rates(laser_factors):
+    """
+    Generate a sorted list of rates (TPG second) that are the products of any
+    non-empty combination of laser_factors.
+
+    The rates are built as a divisor lattice: each distinct factor f with
+    multiplicity k multiplies the rates found so far by f**0 ... f**k. For
+    prime factors every product is unique, so the work done is proportional
+    to the number of rates returned rather than 2**len(laser_factors).
+    """
+    multiplicity = Counter(laser_factors)
+    # A factor of 1 only contributes the rate 1 itself
+    has_one = multiplicity.pop(1, 0) > 0
+
+    rates = [1]
+    for factor, count in sorted(multiplicity.items()):
+        powers = [factor**k for k in range(count + 1)]
+        rates = [rate * power for rate in rates for power in powers]
+
+    # Composite factors (e.g. [2, 4]) can still produce repeated products
+    rates = sorted(set(rates))
+    if not has_one and rates[0] == 1:
+        # The empty combination is not a rate
+        rates = rates[1:]
+
+    return rates
+
+
+def make_goose_rate_index(rate_list):
+    """
+    Build a dict of base rate --> allowed goose rates from a list of rates
+    created using make_base_rates().
+
+    A goose rate is only allowed if it is lower than the base rate and
+    divides it exactly, i.e. it is a true sub-harmonic of the base rate. The
+    index is meant to be built once per factor set, after which every base
+    rate lookup is a single dict access.
+    """
+    rates = sorted(set(rate_list))
+    index = {}
+    for n, base_rate in enumerate(rates):
+        index[base_rate] = tuple(
+            rate for rate in rates[:n] if base_rate % rate == 0
+        )
+
+    return index
+
+
+def allowed_goose_rates(base_rate, goose_index):
+    """
+    Return the allowed goose rates for the base rate of the laser, using an
+    index created with make_goose_rate_index().
+    """
+    return goose_index.get(base_rate, ())
@@ -0,0 +1,186 @@
+"""
+Table model for the expert mode readbacks.
+
+Every readback cell is backed by a PyDMChannel whose monitor updates are
+written into a shared store. The view is only told about changed cells by a
+timer running at a configurable maximum refresh rate, so a cell updating
+faster than that costs one repaint per refresh rather than one per update.
+"""
+from functools import partial
+
+from pydm.widgets.channel import PyDMChannel
+from qtpy import QtCore, QtGui
+
+# Default maximum number of view refreshes per second
+DEFAULT_REFRESH_RATE = 10.0
+
+
+class ReadbackCell:
+    """
+    Latest state of one readback channel.
+
+    Arguments
+    ---------
+    address: PyDM channel address, e.g. ca://PV:NAME
+    """
+    def __init__(self, address):
+        self.address = address
+        self.value = None
+        self.connected = False
+        self.enum_strings = None
+        self.precision = None
+
+    def text(self):
+        """
+        Return the value formatted like a PyDMLabel would show it.
+        """
+        value = self.value
+        if value is None:
+            return ""
+        if self.enum_strings is not None and isinstance(value, int):
+            if 0 <= value < len(self.enum_strings):
+                return self.enum_strings[value]
+        if isinstance(value, float) and self.precision is not None:
+            return f"{value:.{self.precision}f}"
+        return str(value)
+
+
+class ReadbackTableModel(QtCore.QAbstractTableModel):
+    """
+    Read-only table of static text and live readback cells.
+
+    Arguments
+    ---------
+    headers: List of column header strings
+    refresh_rate: Maximum number of view refreshes per second
+    parent: Parent QObject
+    """
+    def __init__(self, headers, refresh_rate=DEFAULT_REFRESH_RATE,
+                 parent=None):
+        super().__init__(parent)
+        self._headers = list(headers)
+        self._rows = []
+        self._channels = []
+        self._dirty = set()
+
+        refresh_rate = float(refresh_rate)
+        if not refresh_rate > 0:
+            raise ValueError(
+                f"refresh_rate must be positive, got {refresh_rate}"
+            )
+        self._timer = QtCore.QTimer(self)
+        self._timer.setInterval(max(1, int(1000 / refresh_rate)))
+        self._timer.timeout.connect(self.refresh)
+
+    def add_row(self, cells):
+        """
+        Append a row. Each cell is either a string shown as is or a
+        ReadbackCell.
+        """
+        row = len(self._rows)
+        self.beginInsertRows(QtCore.QModelIndex(), row, row)
+        self._rows.append(list(cells))
+        self.endInsertRows()
+
+        for col, cell in enumerate(cells):
+            if isinstance(cell, ReadbackCell):
+                self._channels.append(self._make_channel(row, col, cell))
+
+    def _make_channel(self, row, col, cell):
+        def update(attr, value):
+            setattr(cell, attr, value)
+            self._dirty.add((row, col))
+
+        return PyDMChannel(
+            address=cell.address,
+            connection_slot=partial(update, "connected"),
+            value_slot=partial(update, "value"),
+            enum_strings_slot=partial(update, "enum_strings"),
+            prec_slot=partial(update, "precision"),
+        )
+
+    @property
+    def connected(self):
+        return self._timer.isActive()
+
+    @property
+    def nchannels(self):
+        return len(self._channels)
+
+    def connect_channels(self):
+        """
+        Connect every readback channel and start refreshing the view.
+        """
+        if self.connected:
+            return
+        for channel in self._channels:
+            channel.connect()
+        self._timer.start()
+
+    def disconnect_channels(self):
+        """
+        Disconnect every readback channel and stop refreshing the view.
+        """
+        if not self.connected:
+            return
+        self._timer.stop()
+        for channel in self._channels:
+            channel.disconnect()
+        for row in self._rows:
+            for cell in row:
+                if isinstance(cell, ReadbackCell):
+                    cell.connected = False
+        self.refresh(force=True)
+
+    def refresh(self, force=False):
+        """
+        Tell the view about the cells that changed since the last refresh,
+        as one dataChanged over the block they span.
+        """
+        if force:
+            dirty = {(0, 0), (self.rowCount() - 1, self.columnCount() - 1)}
+            self._dirty.clear()
+        else:
+            dirty, self._dirty = self._dirty, set()
+        if not dirty or not self._rows:
+            return
+        rows = [row for row, _ in dirty]
+        cols = [col for _, col in dirty]
+        self.dataChanged.emit(
+            self.index(min(rows), min(cols)),
+            self.index(max(rows), max(cols)),
+        )
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        return 0 if parent.isValid() else len(self._rows)
+
+    def columnCount(self, parent=QtCore.QModelIndex()):
+        return 0 if parent.isValid() else len(self._headers)
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        row = self._rows[index.row()]
+        if index.column() >= len(row):
+            return None
+        cell = row[index.column()]
+
+        if role == QtCore.Qt.DisplayRole:
+            if isinstance(cell, ReadbackCell):
+                return cell.text()
+            return cell
+        if role == QtCore.Qt.TextAlignmentRole:
+            return int(QtCore.Qt.AlignCenter)
+        if isinstance(cell, ReadbackCell):
+            if role == QtCore.Qt.ToolTipRole:
+                return cell.address
+            if role == QtCore.Qt.ForegroundRole and not cell.connected:
+                return QtGui.QBrush(QtCore.Qt.gray)
+        return None
+
+    def headerData(self, section, orientation, role=QtCore.Qt.DisplayRole):
+        if role != QtCore.Qt.DisplayRole:
+            return None
+        if orientation == QtCore.Qt.Horizontal:
+            return self._headers[section]
+        return None
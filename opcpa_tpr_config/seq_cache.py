@@ -0,0 +1,194 @@
+"""
+Cache of compiled XPM sequence programs.
+
+Programs are kept in a bounded in-memory LRU cache keyed on the sequence
+parameters, optionally backed by a directory of programs stored as JSON so
+that frequently used presets survive application restarts.
+"""
+import glob
+import hashlib
+import inspect
+import json
+import logging
+import os
+from collections import OrderedDict
+
+import xpm_prog
+from atomic_file import write_atomic
+from psdaq.seq.seq import Branch, ControlRequest, FixedRateSync
+from xpm_prog import make_base_sequence, make_sequence, program_title
+
+logger = logging.getLogger(__name__)
+
+
+def generator_version():
+    """
+    Return a hash of the sequence generator source. Programs stored on disk by
+    a different version of the generator are ignored.
+    """
+    source = inspect.getsource(xpm_prog)
+    return hashlib.sha1(source.encode()).hexdigest()
+
+
+def encode_program(instrset):
+    """
+    Return a JSON serializable form of an instruction list: a list of
+    [instruction type name, args] pairs.
+    """
+    return [[type(instr).__name__, list(instr.args)] for instr in instrset]
+
+
+def decode_program(data):
+    """
+    Rebuild an instruction list stored with encode_program. Only the
+    instruction types generated by xpm_prog are accepted.
+    """
+    instrset = []
+    for name, args in data:
+        if name == "FixedRateSync":
+            instr = FixedRateSync(marker=args[1], occ=int(args[2]))
+        elif name == "ControlRequest":
+            instr = ControlRequest(args[1])
+        elif name == "Branch" and len(args) == 2:
+            instr = Branch.unconditional(line=int(args[1]))
+        elif name == "Branch" and len(args) == 4:
+            instr = Branch.conditional(
+                line=int(args[1]), counter=int(args[2]), value=int(args[3])
+            )
+        else:
+            raise ValueError(f"Unsupported instruction {name} {args}")
+        instrset.append(instr)
+    return instrset
+
+
+class SequenceCache:
+    """
+    LRU cache of compiled sequence programs.
+
+    Arguments
+    ---------
+    maxsize: Maximum number of programs kept in memory
+    cache_dir: Optional directory used to persist programs between runs
+    """
+    def __init__(self, maxsize=128, cache_dir=None):
+        self._maxsize = int(maxsize)
+        self._programs = OrderedDict()
+        self._titles = {}
+        self._cache_dir = cache_dir
+        self._version = generator_version()
+
+        if self._cache_dir is not None:
+            try:
+                os.makedirs(self._cache_dir, exist_ok=True)
+            except OSError as e:
+                # The store is optional, carry on with the memory cache
+                logger.warning("Can't use sequence cache %s: %s",
+                               self._cache_dir, e)
+                self._cache_dir = None
+
+    def laser_sequence(self, base_div, goose_div=None, offset=None):
+        """
+        Return the make_sequence program for the given base divider, goose
+        divider and offset.
+        """
+        key = ("laser", int(base_div), int(goose_div or 0), int(offset or 0))
+        return self._lookup(
+            key, make_sequence, base_div, goose_div or None, offset
+        )
+
+    def base_sequence(self, offset=None):
+        """
+        Return the make_base_sequence program for the given offset.
+        """
+        key = ("base", int(offset or 0))
+        return self._lookup(key, make_base_sequence, offset)
+
+    def find(self, title):
+        """
+        Return the program with the given program_title(), or None. The
+        programs held in memory are searched first, then the on-disk store.
+        Used to restore a previously loaded program.
+        """
+        key = self._titles.get(title)
+        if key is not None and key in self._programs:
+            return list(self._programs[key])
+
+        if self._cache_dir is None or not title:
+            return None
+        # The title fingerprints the program, so a program stored by another
+        # generator version is still the one that was loaded
+        for path in glob.glob(os.path.join(self._cache_dir, "*.json")):
+            stored = self._read(path, check_version=False)
+            if stored is not None and stored[0] == title:
+                return stored[1]
+        return None
+
+    def clear(self):
+        """
+        Drop all programs held in memory. The on-disk store is left alone.
+        """
+        self._programs.clear()
+        self._titles.clear()
+
+    def __len__(self):
+        return len(self._programs)
+
+    def _lookup(self, key, build, *args):
+        if key in self._programs:
+            self._programs.move_to_end(key)
+            return list(self._programs[key])
+
+        instrset = self._load(key)
+        if instrset is None:
+            instrset = build(*args)
+            self._store(key, instrset)
+
+        self._programs[key] = instrset
+        self._titles[program_title(instrset)] = key
+        if len(self._programs) > self._maxsize:
+            _, old = self._programs.popitem(last=False)
+            self._titles.pop(program_title(old), None)
+
+        return list(instrset)
+
+    def _path(self, key):
+        name = "_".join(str(k) for k in key)
+        return os.path.join(self._cache_dir, f"{name}.json")
+
+    def _read(self, path, check_version=True):
+        """
+        Return the (title, program) stored in a file, or None if it is
+        missing, unreadable or, if check_version, stored by another version
+        of the generator.
+        """
+        try:
+            with open(path) as f:
+                stored = json.load(f)
+            if check_version and stored["version"] != self._version:
+                return None
+            return stored.get("title"), decode_program(stored["program"])
+        except FileNotFoundError:
+            return None
+        except Exception:
+            logger.warning("Ignoring unreadable cached sequence %s", path)
+            return None
+
+    def _load(self, key):
+        if self._cache_dir is None:
+            return None
+        stored = self._read(self._path(key))
+        return None if stored is None else stored[1]
+
+    def _store(self, key, instrset):
+        if self._cache_dir is None:
+            return
+        path = self._path(key)
+        stored = {
+            "version": self._version,
+            "title": program_title(instrset),
+            "program": encode_program(instrset),
+        }
+        try:
+            write_atomic(path, json.dumps(stored))
+        except OSError:
+            logger.warning("Could not store cached sequence %s", path)
@@ -0,0 +1,180 @@
+"""
+Offline models of XPM sequence engine programs.
+
+These work directly on the instruction lists generated by xpm_prog
+(make_sequence, make_base_sequence) and never talk to the XPM, so they can be
+used to check a sequence before it is loaded into the sequence engine. The
+programs are parsed by seq_rates and simulated bucket by bucket with numpy.
+"""
+import argparse
+
+import numpy as np
+from rates import carbide_factors, make_base_rates, make_goose_rate_index
+from seq_rates import BUCKETS_PER_SECOND, block_duration, parse_program
+from xpm_prog import make_base_sequence, make_sequence
+
+
+def _block_events(nodes, limit):
+    """
+    Return (times, masks) arrays of the control requests issued by one pass
+    through a node list, relative to its start and truncated at limit
+    buckets. Loops are expanded by tiling the events of their body.
+    """
+    times = []
+    masks = []
+    single_times = []
+    single_masks = []
+    t = 0
+    for node in nodes:
+        if t >= limit:
+            break
+        if node[0] == "request":
+            single_times.append(t)
+            single_masks.append(node[1])
+        elif node[0] == "sync":
+            t += node[1]
+        else:
+            count, body = node[1], node[2]
+            duration = block_duration(body)
+            if duration > 0:
+                reps = min(count, -(-(limit - t) // duration))
+            else:
+                reps = count
+            body_times, body_masks = _block_events(body, limit - t)
+            starts = t + duration * np.arange(reps, dtype=np.int64)
+            times.append((starts[:, None] + body_times[None, :]).ravel())
+            masks.append(np.tile(body_masks, reps))
+            t += duration * count
+
+    times.append(np.array(single_times, dtype=np.int64))
+    masks.append(np.array(single_masks, dtype=np.uint32))
+    times = np.concatenate(times)
+    masks = np.concatenate(masks)
+    keep = times < limit
+
+    return times[keep], masks[keep]
+
+
+def simulate(instrset, nbuckets=BUCKETS_PER_SECOND):
+    """
+    Simulate a sequence engine program over nbuckets 910 kHz buckets
+    (default one second).
+
+    Supports ControlRequest, FixedRateSync on the 910kH marker, and
+    unconditional and conditional Branch instructions.
+
+    returns:
+        numpy uint32 array with the control request bitmask of each bucket
+    """
+    prefix, body = parse_program(instrset)
+    if body is not None:
+        duration = block_duration(body)
+        if duration == 0:
+            raise ValueError("Repeated part of the program never waits")
+        remaining = max(nbuckets - block_duration(prefix), 0)
+        reps = -(-remaining // duration)
+        prefix = prefix + [("loop", reps, body)]
+
+    times, masks = _block_events(prefix, nbuckets)
+    buckets = np.zeros(nbuckets, dtype=np.uint32)
+    # Requests landing in the same bucket are OR'd together; set one bit at
+    # a time so repeated indices are harmless.
+    for bit in range(int(masks.max(initial=0)).bit_length()):
+        buckets[times[(masks >> bit) & 1 == 1]] |= (1 << bit)
+
+    return buckets
+
+
+def code_counts(buckets, ncodes=4):
+    """
+    Return the number of buckets in which each of the engine's event codes
+    fires. For a one second simulation these are the code rates in Hz.
+    """
+    return [int(np.count_nonzero(buckets & (1 << n))) for n in range(ncodes)]
+
+
+def expected_sequence(base_div, goose_div=None, offset=None,
+                      nbuckets=BUCKETS_PER_SECOND):
+    """
+    Return the bucket bitmasks make_sequence is meant to produce: code 2 on
+    every laser shot, code 1 on every goose shot and code 0 on the rest.
+    """
+    offset = offset or 0
+    buckets = np.zeros(nbuckets, dtype=np.uint32)
+    buckets[offset::base_div] = (1 << 2) | (1 << 0)
+    if goose_div not in (None, 0):
+        buckets[offset::goose_div] = (1 << 2) | (1 << 1)
+
+    return buckets
+
+
+def expected_base_sequence(offset=None, nbuckets=BUCKETS_PER_SECOND):
+    """
+    Return the bucket bitmasks make_base_sequence is meant to produce: the
+    910 kHz, 32.5 kHz, 100 Hz and 5 Hz codes on bits 0 to 3.
+    """
+    offset = offset or 0
+    buckets = np.zeros(nbuckets, dtype=np.uint32)
+    for bit, div in enumerate((1, 28, 9100, 182000)):
+        buckets[offset::div] |= (1 << bit)
+
+    return buckets
+
+
+def check_sequences(offsets, debug=False):
+    """
+    Simulate every base/goose rate combination and base sequence for the
+    given offsets and compare them with the expected patterns.
+
+    returns:
+        List of (base_rate, goose_rate, offset) combinations that failed.
+        The base sequence is reported with base_rate and goose_rate None.
+    """
+    base_rates = make_base_rates(carbide_factors)
+    goose_index = make_goose_rate_index(base_rates)
+    failures = []
+    for offset in offsets:
+        if not np.array_equal(
+            simulate(make_base_sequence(offset)),
+            expected_base_sequence(offset)
+        ):
+            failures.append((None, None, offset))
+        for base_rate in base_rates:
+            base_div = BUCKETS_PER_SECOND//base_rate
+            for goose_rate in (None,) + goose_index[base_rate]:
+                goose_div = None
+                if goose_rate is not None:
+                    goose_div = BUCKETS_PER_SECOND//goose_rate
+                instrset = make_sequence(base_div, goose_div, offset)
+                if not np.array_equal(
+                    simulate(instrset),
+                    expected_sequence(base_div, goose_div, offset)
+                ):
+                    failures.append((base_rate, goose_rate, offset))
+                elif debug:
+                    print(f"OK: {base_rate} {goose_rate} {offset}")
+
+    return failures
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        "offsets", nargs="*", type=int, default=[0],
+        help="910 kHz bucket offsets to check (default 0)"
+    )
+    parser.add_argument(
+        "-d", "--debug", action='store_true',
+        help="Print every checked combination"
+    )
+
+    args = parser.parse_args()
+
+    failures = check_sequences(args.offsets, args.debug)
+    for base_rate, goose_rate, offset in failures:
+        print(f"Mismatch: base {base_rate} goose {goose_rate} "
+              f"offset {offset}")
+    if failures:
+        raise SystemExit(1)
+    print("All sequences match")
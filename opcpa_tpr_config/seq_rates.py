@@ -0,0 +1,181 @@
+"""
+Loop structure of XPM sequence engine programs.
+
+Parses the instruction lists generated by xpm_prog (make_sequence,
+make_base_sequence) into nested loops and works out the event code rates
+they produce without expanding the loops. Only the standard library is
+needed, so the GUI can check a sequence cheaply; seq_model simulates
+programs bucket by bucket with numpy.
+"""
+from fractions import Fraction
+
+from psdaq.seq.seq import Branch, ControlRequest, FixedRateSync
+
+BUCKETS_PER_SECOND = 910000
+
+# FixedRateSync marker --> marker interval in 910 kHz buckets. Only markers
+# that fire every bucket can be modelled without tracking absolute time.
+MARKER_INTERVALS = {"910kH": 1}
+
+
+def request_mask(instr):
+    """
+    Return the control request bitmask of a ControlRequest instruction. The
+    request may have been given either as a list of bits or as a bitmask.
+    """
+    word = instr.args[1]
+    if isinstance(word, (list, tuple)):
+        mask = 0
+        for bit in word:
+            mask |= (1 << bit)
+        return mask
+    return int(word)
+
+
+def sync_buckets(instr):
+    """
+    Return the number of 910 kHz buckets a FixedRateSync instruction waits.
+    """
+    marker, occ = instr.args[1], instr.args[2]
+    if marker not in MARKER_INTERVALS:
+        raise ValueError(
+            f"Unsupported FixedRateSync marker {marker!r}, expected one of "
+            f"{list(MARKER_INTERVALS)}"
+        )
+    return MARKER_INTERVALS[marker] * int(occ)
+
+
+def _is_conditional(instr):
+    return isinstance(instr, Branch) and len(instr.args) == 4
+
+
+def _is_unconditional(instr):
+    return isinstance(instr, Branch) and len(instr.args) == 2
+
+
+def _parse_block(instrset, lo, hi, counters):
+    """
+    Parse instrset[lo:hi] into a list of nodes:
+
+    ("request", mask): ControlRequest issued in the current bucket
+    ("sync", n): FixedRateSync waiting n buckets
+    ("loop", count, nodes): nodes repeated count times by a Branch.conditional
+    """
+    nodes = []
+    i = lo
+    while i < hi:
+        # The outermost loop starting here ends at the last conditional branch
+        # in this block that jumps back to line i.
+        loop_end = None
+        for j in range(hi - 1, i - 1, -1):
+            if _is_conditional(instrset[j]) and instrset[j].args[1] == i:
+                loop_end = j
+                break
+
+        if loop_end is not None:
+            counter, value = instrset[loop_end].args[2:4]
+            if counter in counters:
+                raise ValueError(
+                    f"Loop ending at line {loop_end} reuses counter "
+                    f"{counter} of an enclosing loop"
+                )
+            body = _parse_block(
+                instrset, i, loop_end, counters + (counter,)
+            )
+            # Branch.conditional falls through once the counter reaches
+            # value, so the body runs value + 1 times.
+            nodes.append(("loop", int(value) + 1, body))
+            i = loop_end + 1
+            continue
+
+        instr = instrset[i]
+        if isinstance(instr, ControlRequest):
+            nodes.append(("request", request_mask(instr)))
+        elif isinstance(instr, FixedRateSync):
+            nodes.append(("sync", sync_buckets(instr)))
+        elif isinstance(instr, Branch):
+            raise ValueError(
+                f"Branch at line {i} does not close a loop within lines "
+                f"{lo}-{hi - 1}"
+            )
+        else:
+            raise ValueError(
+                f"Unsupported instruction {type(instr).__name__} at line {i}"
+            )
+        i += 1
+
+    return nodes
+
+
+def parse_program(instrset):
+    """
+    Split an instruction list into the nodes run once at start up and the
+    nodes repeated forever by the final Branch.unconditional.
+
+    returns:
+        (prefix, body) node lists, body is None if the program does not end
+        in an unconditional branch and therefore only runs once
+    """
+    if instrset and _is_unconditional(instrset[-1]):
+        start = instrset[-1].args[1]
+        if not 0 <= start < len(instrset) - 1:
+            raise ValueError(f"Final branch to invalid line {start}")
+        prefix = _parse_block(instrset, 0, start, ())
+        body = _parse_block(instrset, start, len(instrset) - 1, ())
+        return prefix, body
+
+    return _parse_block(instrset, 0, len(instrset), ()), None
+
+
+def block_duration(nodes):
+    """
+    Return the number of buckets taken by one pass through a node list.
+    """
+    duration = 0
+    for node in nodes:
+        if node[0] == "sync":
+            duration += node[1]
+        elif node[0] == "loop":
+            duration += node[1] * block_duration(node[2])
+    return duration
+
+
+def _block_counts(nodes, ncodes):
+    """
+    Return the number of requests for each code in one pass through a node
+    list.
+    """
+    counts = [0] * ncodes
+    for node in nodes:
+        if node[0] == "request":
+            for n in range(ncodes):
+                if node[1] & (1 << n):
+                    counts[n] += 1
+        elif node[0] == "loop":
+            body_counts = _block_counts(node[2], ncodes)
+            for n in range(ncodes):
+                counts[n] += node[1] * body_counts[n]
+    return counts
+
+
+def predict_rates(instrset, ncodes=4):
+    """
+    Return the steady state rate in Hz of each of the engine's event codes,
+    worked out from the loop structure of the program without expanding it.
+
+    The rates are exact Fractions. They assume at most one request per code
+    in any bucket, which holds for programs that wait at least one bucket
+    between ControlRequests, like the ones built by xpm_prog. A program that
+    does not repeat has a steady state rate of 0 for every code.
+    """
+    prefix, body = parse_program(instrset)
+    if body is None:
+        return [Fraction(0)] * ncodes
+    duration = block_duration(body)
+    if duration == 0:
+        raise ValueError("Repeated part of the program never waits")
+
+    return [
+        Fraction(count * BUCKETS_PER_SECOND, duration)
+        for count in _block_counts(body, ncodes)
+    ]
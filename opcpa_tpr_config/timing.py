@@ -0,0 +1,203 @@
+"""
+Phase timing of configuration Applies.
+
+An ApplyTimer records how long each phase of an Apply took, using monotonic
+timestamps relative to the start of the Apply. Phases may be recorded from
+several threads at once. The records of a finished Apply can be appended to
+a JSON lines log and exported as a Prometheus text file, e.g. for the
+node_exporter textfile collector.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+from atomic_file import write_atomic
+
+logger = logging.getLogger(__name__)
+
+
+class ApplyTimer:
+    """
+    Collects the phase timings of one Apply.
+
+    Arguments
+    ---------
+    name: Name of the timed system, e.g. the laser bay
+    """
+    def __init__(self, name=""):
+        self.name = name
+        self.started = time.time()
+        self._t0 = time.monotonic()
+        self._t1 = None
+        self._records = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, phase, target=None):
+        """
+        Context manager timing one phase. target optionally names what the
+        phase acted on, e.g. a device or engine.
+        """
+        start = time.monotonic()
+        ok = False
+        try:
+            yield
+            ok = True
+        finally:
+            end = time.monotonic()
+            record = {
+                "phase": phase,
+                "target": target,
+                "start": start - self._t0,
+                "duration": end - start,
+                "ok": ok,
+                "thread": threading.current_thread().name,
+            }
+            with self._lock:
+                self._records.append(record)
+
+    def timed(self, phase, func, target=None):
+        """
+        Return a function that calls func inside a phase.
+        """
+        def call(*args, **kwargs):
+            with self.phase(phase, target):
+                return func(*args, **kwargs)
+        return call
+
+    def stop(self):
+        """
+        Mark the end of the Apply.
+        """
+        self._t1 = time.monotonic()
+
+    @property
+    def duration(self):
+        end = self._t1 if self._t1 is not None else time.monotonic()
+        return end - self._t0
+
+    @property
+    def records(self):
+        """
+        Copy of the phase records, in order of start time.
+        """
+        with self._lock:
+            return sorted(self._records, key=lambda r: r["start"])
+
+    def totals(self):
+        """
+        Return the summed duration and number of calls of each phase.
+
+        returns:
+            Dict of (phase, target) --> (seconds, count)
+        """
+        totals = {}
+        for record in self.records:
+            key = (record["phase"], record["target"])
+            seconds, count = totals.get(key, (0.0, 0))
+            totals[key] = (seconds + record["duration"], count + 1)
+        return totals
+
+
+def phase(timer, phase, target=None):
+    """
+    Time a phase if timer is not None, otherwise do nothing.
+    """
+    if timer is None:
+        return nullcontext()
+    return timer.phase(phase, target)
+
+
+def write_json_log(path, timer, ok, **fields):
+    """
+    Append one JSON line describing a finished Apply to a log file.
+    """
+    entry = {
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z",
+                              time.localtime(timer.started)),
+        "name": timer.name,
+        "ok": bool(ok),
+        "duration": timer.duration,
+        **fields,
+        "phases": timer.records,
+    }
+    with open(path, "a") as f:
+        f.write(json.dumps(entry) + "\n")
+
+
+def _labels(**labels):
+    text = ",".join(
+        '{}="{}"'.format(
+            key,
+            str(value).replace("\\", "\\\\").replace('"', '\\"')
+        )
+        for key, value in labels.items() if value is not None
+    )
+    return f"{{{text}}}"
+
+
+def prometheus_text(timer, ok):
+    """
+    Return the timings of the last Apply in the Prometheus text format.
+    """
+    lines = [
+        "# HELP opcpa_apply_duration_seconds Duration of the last Apply",
+        "# TYPE opcpa_apply_duration_seconds gauge",
+        f"opcpa_apply_duration_seconds{_labels(name=timer.name)} "
+        f"{timer.duration:.6f}",
+        "# HELP opcpa_apply_success Whether the last Apply succeeded",
+        "# TYPE opcpa_apply_success gauge",
+        f"opcpa_apply_success{_labels(name=timer.name)} {int(bool(ok))}",
+        "# HELP opcpa_apply_timestamp_seconds Start time of the last Apply",
+        "# TYPE opcpa_apply_timestamp_seconds gauge",
+        f"opcpa_apply_timestamp_seconds{_labels(name=timer.name)} "
+        f"{timer.started:.3f}",
+        "# HELP opcpa_apply_phase_seconds Time spent in each phase of the "
+        "last Apply",
+        "# TYPE opcpa_apply_phase_seconds gauge",
+    ]
+    totals = timer.totals()
+    for (phase, target), (seconds, _) in totals.items():
+        labels = _labels(name=timer.name, phase=phase, target=target)
+        lines.append(f"opcpa_apply_phase_seconds{labels} {seconds:.6f}")
+    lines += [
+        "# HELP opcpa_apply_phase_calls Number of times each phase ran in "
+        "the last Apply",
+        "# TYPE opcpa_apply_phase_calls gauge",
+    ]
+    for (phase, target), (_, count) in totals.items():
+        labels = _labels(name=timer.name, phase=phase, target=target)
+        lines.append(f"opcpa_apply_phase_calls{labels} {count}")
+
+    return "\n".join(lines) + "\n"
+
+
+def write_prometheus(path, timer, ok):
+    """
+    Write the timings of the last Apply to a Prometheus text file. The file
+    is replaced atomically so a collector never reads a partial file.
+    """
+    write_atomic(path, prometheus_text(timer, ok))
+
+
+def export_metrics(metrics_dir, prefix, timer, error=None):
+    """
+    Append an Apply to <prefix>_apply.jsonl and write <prefix>_apply.prom in
+    metrics_dir. Errors are logged, never raised, so metrics can't fail an
+    Apply.
+    """
+    ok = error is None
+    try:
+        os.makedirs(metrics_dir, exist_ok=True)
+        write_json_log(
+            os.path.join(metrics_dir, f"{prefix}_apply.jsonl"), timer, ok,
+            error=error
+        )
+        write_prometheus(
+            os.path.join(metrics_dir, f"{prefix}_apply.prom"), timer, ok
+        )
+    except OSError:
+        logger.exception("Could not write Apply metrics to %s", metrics_dir)
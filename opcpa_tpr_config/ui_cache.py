@@ -0,0 +1,148 @@
+"""
+Cache of the Qt Designer forms compiled to Python.
+
+Each .ui file is compiled with uic into a module named after the file and a
+hash of its contents, so an edited .ui file is never matched with a stale
+form. The cache can be filled ahead of time with the build step:
+
+    python ui_cache.py [--cache-dir DIR]
+
+Displays fall back to loading the .ui file at runtime when the cache can't
+be used.
+"""
+import argparse
+import glob
+import hashlib
+import importlib.util
+import logging
+import os
+from io import StringIO
+from os import path
+
+from atomic_file import write_atomic
+
+logger = logging.getLogger(__name__)
+
+UI_DIR = path.dirname(path.realpath(__file__))
+
+UI_FILES = [
+    "user_config.ui",
+    "rep_rate_config.ui",
+    "sc_metadata.ui",
+    "expert_screen.ui",
+]
+
+DEFAULT_CACHE_DIR = os.environ.get(
+    "OPCPA_UI_CACHE", path.join(UI_DIR, "compiled_ui")
+)
+
+_forms = {}
+
+
+def ui_hash(ui_path):
+    """
+    Return the content hash of a .ui file.
+    """
+    with open(ui_path, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()[:16]
+
+
+def compiled_path(ui_path, cache_dir=DEFAULT_CACHE_DIR, digest=None):
+    """
+    Return the path of the compiled form of a .ui file.
+    """
+    stem = path.splitext(path.basename(ui_path))[0]
+    digest = digest or ui_hash(ui_path)
+    return path.join(cache_dir, f"ui_{stem}_{digest}.py")
+
+
+def compile_form(ui_path, cache_dir=DEFAULT_CACHE_DIR):
+    """
+    Compile a .ui file into the cache, replacing older compiled versions.
+
+    returns:
+        Path of the compiled form
+    """
+    from qtpy import uic
+
+    os.makedirs(cache_dir, exist_ok=True)
+    target = compiled_path(ui_path, cache_dir)
+
+    code = StringIO()
+    uic.compileUi(ui_path, code)
+
+    write_atomic(target, code.getvalue())
+
+    stem = path.splitext(path.basename(ui_path))[0]
+    for old in glob.glob(path.join(cache_dir, f"ui_{stem}_*.py")):
+        if old != target:
+            os.remove(old)
+
+    return target
+
+
+def load_form_class(ui_path, cache_dir=DEFAULT_CACHE_DIR,
+                    compile_missing=True):
+    """
+    Return the uic form class (Ui_...) of a .ui file from the cache.
+
+    Arguments
+    ---------
+    ui_path: Path of the .ui file
+    cache_dir: Directory of compiled forms
+    compile_missing: Compile the form into the cache if it is not there yet
+
+    returns:
+        The form class, or None if the cache can't provide it
+    """
+    try:
+        target = compiled_path(ui_path, cache_dir)
+        if target in _forms:
+            return _forms[target]
+        if not path.exists(target):
+            if not compile_missing:
+                return None
+            compile_form(ui_path, cache_dir)
+
+        name = path.splitext(path.basename(target))[0]
+        spec = importlib.util.spec_from_file_location(name, target)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        form = next(
+            value for key, value in vars(module).items()
+            if key.startswith("Ui_")
+        )
+    except Exception as e:
+        logger.warning("No compiled form for %s, loading it at runtime: %s",
+                       ui_path, e)
+        return None
+
+    _forms[target] = form
+    return form
+
+
+def build(cache_dir=DEFAULT_CACHE_DIR, ui_files=UI_FILES):
+    """
+    Compile the application's .ui files into the cache.
+    """
+    for ui_file in ui_files:
+        ui_path = path.join(UI_DIR, ui_file)
+        target = compiled_path(ui_path, cache_dir)
+        if path.exists(target):
+            print(f"{ui_file}: up to date")
+        else:
+            compile_form(ui_path, cache_dir)
+            print(f"{ui_file}: compiled to {target}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        "--cache-dir", default=DEFAULT_CACHE_DIR,
+        help=f"Directory of compiled forms (default {DEFAULT_CACHE_DIR})"
+    )
+
+    args = parser.parse_args()
+
+    build(args.cache_dir)
@@ -1,24 +1,33 @@
 import logging
-from typing import Optional
-
-from qtpy import QtWidgets
-from widgets import UserConfigDisplay
+from typing import List, Optional, Union
 
 logger = logging.getLogger(__name__)
 
 
 def main(
-    config: str = "",
+    config: Union[str, List[str]] = "",
     debug: bool = False,
     stylesheet: Optional[str] = None
 ) -> None:
-    """Launch the ``Rep. rate user config UI``."""
+    """
+    Launch the ``Rep. rate user config UI``. Several configuration files open
+    as tabs of a single console.
+    """
+    # Qt, pydm and the EPICS stack only load once the UI is actually started
+    from qtpy import QtWidgets
+    from widgets import MultiBayDisplay, UserConfigDisplay
+
+    configs = [config] if isinstance(config, str) else list(config)
+
     app = QtWidgets.QApplication.instance()
     if app is None:
         app = QtWidgets.QApplication([])
 
     try:
-        widget = UserConfigDisplay(config=config, debug=debug)
+        if len(configs) == 1:
+            widget = UserConfigDisplay(config=configs[0], debug=debug)
+        else:
+            widget = MultiBayDisplay(configs=configs, debug=debug)
         widget.show()
         app.exec_()
     except Exception:
@@ -30,7 +39,9 @@ if __name__ == "__main__":
 
     parser = argparse.ArgumentParser()
     parser.add_argument(
-        "-c", "--config", help="Yaml config file for user UI", type=str
+        "-c", "--config", action="append", type=str, required=True,
+        help="Yaml config file for user UI, repeat to open several bays as "
+             "tabs"
     )
     parser.add_argument(
         "-d", "--debug", action='store_true',
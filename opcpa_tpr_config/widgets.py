@@ -2,32 +2,49 @@ from __future__ import annotations
 
 import logging
 import time
+from functools import partial
 from os import path
 
-import happi
-import yaml
+from app_config import freeze, load_config
+from devices import (DevicePool, get_catalog, setting_signal, try_read_setting,
+                     values_match, write_settings)
 from ophyd import EpicsSignal
-from psdaq.cas.pvedit import Pv
-from psdaq.seq.seqprogram import SeqUser
+from parallel import BatchError, run_concurrently
+from pv_names import get_pvname
 from pydm import Display
 from pydm import widgets as pydm_widgets
-from qtpy import QtWidgets
-from xpm_prog import (allowed_goose_rates, carbide_factors, make_base_rates,
-                      make_base_sequence, make_sequence)
+from qtpy import QtCore, QtWidgets
+from rates import (allowed_goose_rates, carbide_factors, make_base_rates,
+                   make_goose_rate_index)
+from rbv_table import DEFAULT_REFRESH_RATE, ReadbackCell, ReadbackTableModel
+from seq_cache import SequenceCache
+from seq_rates import predict_rates
+from timing import ApplyTimer, export_metrics, phase
+from ui_cache import load_form_class
+from xpm_channels import get_xpm_channels
+from xpm_prog import (engine_program_title, make_sequence, program_title,
+                      write_seqcodes_desc)
 
 logger = logging.getLogger(__name__)
 
 
-def read_config(config_file):
+class CompiledDisplay(Display):
     """
-    Read in the config file for the screen.
+    Display that sets up its form from the compiled form cache (see
+    ui_cache), falling back to loading the .ui file at runtime.
     """
-    with open(config_file, "r") as f:
-        conf = yaml.safe_load(f)
-    return conf
+    def load_ui_from_file(self, ui_file_path, macros=None):
+        form = None if macros else load_form_class(ui_file_path)
+        if form is None:
+            return super().load_ui_from_file(ui_file_path, macros)
 
+        self._loaded_file = ui_file_path
+        self.retranslateUi = partial(form.retranslateUi, self)
+        form.setupUi(self, self)
+        self.ui = self
 
-class SCMetadataDisplay(Display):
+
+class SCMetadataDisplay(CompiledDisplay):
     """
     Class for SC metatdata user display.
     """
@@ -45,15 +62,7 @@ class SCMetadataDisplay(Display):
         """
         self._debug = debug
 
-        self._config = read_config(config)
-        if self._config is None:
-            raise ValueError(f"Could not read config file {config}")
-
-        if self._debug:
-            print(f"Read configuration file: {config}")
-            cfg_keys = self._config.keys()
-            print(f"Configuration sections: {cfg_keys}")
-            print(self._config)
+        self._config = config
 
         self.update_pvs()
 
@@ -83,7 +92,7 @@ class SCMetadataDisplay(Display):
         )
 
 
-class LaserConfigDisplay(Display):
+class LaserConfigDisplay(CompiledDisplay):
     """
     Class for rep. rate configuration application user display.
     """
@@ -94,6 +103,9 @@ class LaserConfigDisplay(Display):
     off_time_rate_rbv: pydm_widgets.PyDMLabel
     all_shots_ec_rbv: pydm_widgets.PyDMLabel
     all_shots_rate_rbv: pydm_widgets.PyDMLabel
+    on_time_predicted: QtWidgets.QLabel
+    off_time_predicted: QtWidgets.QLabel
+    all_shots_predicted: QtWidgets.QLabel
 
     sc_bucket_control_box: QtWidgets.QComboBox
     sc_bucket_edit: QtWidgets.QLineEdit
@@ -127,28 +139,18 @@ class LaserConfigDisplay(Display):
         """
         self._debug = debug
 
-        self._config = read_config(config)
-        if self._config is None:
-            raise ValueError(f"Could not read config file {config}")
+        self._config = config
 
         # Event code data
         self._engine1 = int(self._config['main']['engine1'])
         self._engine2 = int(self._config['main']['engine2'])
 
-        if self._debug:
-            print(f"Read configuration file: {config}")
-            cfg_keys = self._config.keys()
-            print(f"Configuration sections: {cfg_keys}")
-            print(self._config)
-
         self.status_label.setText("Status: Idle")
-        # Hiding this because the status doesn't work well without threading
-        # the configuration method. Will remove once that's done in a later PR
-        self.status_label.setVisible(False)
 
         self.update_pvs()
 
         self._base_rates = make_base_rates(carbide_factors)
+        self._goose_rates = make_goose_rate_index(self._base_rates)
 
         self.update_base_rates()
 
@@ -170,6 +172,24 @@ class LaserConfigDisplay(Display):
             self.update_bucket_control_vis
         )
 
+        self._predicted_rates = None
+        self.update_predicted_rates()
+        self.total_rate_box.currentTextChanged.connect(
+            self.update_predicted_rates
+        )
+        self.goose_rate_box.currentTextChanged.connect(
+            self.update_predicted_rates
+        )
+        self.goose_arrival_box.currentTextChanged.connect(
+            self.update_predicted_rates
+        )
+
+        # Live rates update about once per second, so compare them with the
+        # prediction at the same pace.
+        self._rate_check_timer = QtCore.QTimer(self)
+        self._rate_check_timer.timeout.connect(self.check_predicted_rates)
+        self._rate_check_timer.start(1000)
+
     def update_pvs(self):
         """
         Modify RBV widgets to use the PV(s) specified in the config file.
@@ -247,8 +267,6 @@ class LaserConfigDisplay(Display):
             for rate in self._base_rates:
                 # Restrict allowed rates to > 1kHz, but keep all rates in
                 # self._base_rates for allowed goose rate calculation
-                # TODO: The calculation of goose rates could probably be
-                # decoupled from the base rate array.
                 if rate >= 1000:
                     self.total_rate_box.addItem(str(rate))
             if self._debug:
@@ -270,13 +288,13 @@ class LaserConfigDisplay(Display):
         if self._base_rates is not None:
             goose_rates = allowed_goose_rates(
                 self.base_rate,
-                self._base_rates
+                self._goose_rates
             )
             self.goose_rate_box.clear()
             for rate in goose_rates:
                 self.goose_rate_box.addItem(str(rate))
             if self._debug:
-                print(f"Requested base rate: {rate}")
+                print(f"Requested base rate: {self.base_rate}")
                 print(f"Allowed goose rates: {goose_rates}")
 
     @property
@@ -290,10 +308,12 @@ class LaserConfigDisplay(Display):
                 print(f"Goose arrival configs: {cfgs}")
             for name, cfg in cfgs.items():
                 text = cfg['desc']
-                cfg.pop('desc', None)
+                # The config is shared, so build the device settings
+                # without 'desc' rather than removing it
+                devices = {k: v for k, v in cfg.items() if k != 'desc'}
                 self.goose_arrival_box.addItem(
                     text,
-                    userData=cfg
+                    userData=freeze(devices)
                 )
 
     @property
@@ -308,6 +328,56 @@ class LaserConfigDisplay(Display):
         else:
             return False
 
+    def update_predicted_rates(self):
+        """
+        Show the on time, goose and all shot rates that the selected
+        configuration will produce, predicted from the generated sequence
+        before anything is written to the XPM.
+        """
+        try:
+            base_div = 910000//self.base_rate
+            goose_div = None
+            if self.goose_enabled:
+                goose_div = 910000//self.goose_rate
+            rates = predict_rates(make_sequence(base_div, goose_div))
+        except ValueError:
+            # Rate boxes are empty while they are being repopulated
+            rates = None
+
+        self._predicted_rates = rates
+        labels = [
+            self.on_time_predicted,
+            self.off_time_predicted,
+            self.all_shots_predicted,
+        ]
+        for idx, label in enumerate(labels):
+            if rates is None:
+                label.setText("")
+            else:
+                label.setText(f"{float(rates[idx]):.10g}")
+
+        self.check_predicted_rates()
+
+    def check_predicted_rates(self):
+        """
+        Highlight predicted rates that do not match the live XPM rates.
+        """
+        rbvs = [
+            (self.on_time_rate_rbv, self.on_time_predicted),
+            (self.off_time_rate_rbv, self.off_time_predicted),
+            (self.all_shots_rate_rbv, self.all_shots_predicted),
+        ]
+        for idx, (rbv, label) in enumerate(rbvs):
+            mismatch = False
+            if self._predicted_rates is not None and rbv.value is not None:
+                try:
+                    live = float(rbv.value)
+                except (TypeError, ValueError):
+                    live = None
+                if live is not None:
+                    mismatch = abs(live - self._predicted_rates[idx]) > 1
+            label.setStyleSheet("color: red" if mismatch else "")
+
     def update_bucket_control_items(self):
         modes = ['Manual', 'Auto']
         for mode in modes:
@@ -329,7 +399,7 @@ class LaserConfigDisplay(Display):
         return int(self.sc_bucket_edit.text())
 
 
-class ExpertDisplay(Display):
+class ExpertDisplay(CompiledDisplay):
     """
     Class for expert level user display.
     """
@@ -356,166 +426,239 @@ class ExpertDisplay(Display):
 
         self._debug = debug
 
-        self._config = read_config(config)
-        if self._config is None:
-            raise ValueError(f"Could not read config file {config}")
+        self._config = config
 
-        if self._config is not None:
-            self._db = happi.Client(
-                path=self._config['main']['laser_database']
-            )
+        self._db = get_catalog(self._config['main']['laser_database'])
 
+        # The readback channels are only connected while expert mode is
+        # shown, see set_visibility.
         xpm_pv = self._config['main']['xpm_pv']
-        self.xpm_table.set_channel(f"pva://{xpm_pv}:SEQCODES")
+        self._xpm_channel = f"pva://{xpm_pv}:SEQCODES"
+        self._refresh_rate = float(
+            self._config['main'].get('expert_refresh_rate',
+                                     DEFAULT_REFRESH_RATE)
+        )
+        self._connected = False
 
         self.configure_rbv_frames()
 
     def set_visibility(self, visible):
         """
         Update visibility of "expert mode" widgets based on expert mode check
-        box status.
+        box status. The readback channels are connected while the widgets are
+        visible and disconnected when they are hidden.
         """
         self.xpm_table.setVisible(visible)
         self.tpr_frame.setVisible(visible)
         self.rbv_frame.setVisible(visible)
 
+        if visible:
+            self.connect_rbvs()
+        else:
+            self.disconnect_rbvs()
+
+    def connect_rbvs(self):
+        """
+        Connect every readback to its channel.
+        """
+        if self._connected:
+            return
+        self.xpm_table.set_channel(self._xpm_channel)
+        for model in (self._tpr_model, self._rbv_model):
+            model.connect_channels()
+        self._connected = True
+        if self._debug:
+            nchannels = self._tpr_model.nchannels + self._rbv_model.nchannels
+            print(f"Connected {nchannels + 1} expert channels")
+
+    def disconnect_rbvs(self):
+        """
+        Disconnect every readback from its channel, releasing the underlying
+        CA/PVA connections.
+        """
+        if not self._connected:
+            return
+        self.xpm_table.set_channel("")
+        for model in (self._tpr_model, self._rbv_model):
+            model.disconnect_channels()
+        self._connected = False
+        if self._debug:
+            print("Disconnected expert channels")
+
     def configure_rbv_frames(self):
         """
-        Add a layout and widgets to the rbv frame based on the laser system
+        Add a table of readbacks to each rbv frame based on the laser system
         happi database.
         """
-        tpr_layout = QtWidgets.QGridLayout()
-        tpr_layout = self.setup_tpr_rbvs(self._config, self._db, tpr_layout)
-        self.tpr_frame.setLayout(tpr_layout)
+        self._tpr_model = ReadbackTableModel(
+            ["Trigger", "Rep. Rate", "Rate Mode", "Event Code", "Width (ns)",
+             "Delay (ns)", "Logic", "Status"],
+            self._refresh_rate, self
+        )
+        self.setup_tpr_rbvs(self._config, self._db, self._tpr_model)
+        self.tpr_frame.setLayout(self.make_rbv_layout(self._tpr_model))
+
+        self._rbv_model = ReadbackTableModel(
+            ["Signal", "Value"], self._refresh_rate, self
+        )
+        self.setup_signal_rbvs(self._config, self._db, self._rbv_model)
+        self.rbv_frame.setLayout(self.make_rbv_layout(self._rbv_model))
+
+    def make_rbv_layout(self, model):
+        """
+        Return a layout holding a read-only table view of a readback model.
+        """
+        view = QtWidgets.QTableView()
+        view.setModel(model)
+        view.verticalHeader().setVisible(False)
+        view.setEditTriggers(QtWidgets.QAbstractItemView.NoEditTriggers)
+        view.setSelectionMode(QtWidgets.QAbstractItemView.NoSelection)
+        view.horizontalHeader().setSectionResizeMode(
+            QtWidgets.QHeaderView.Stretch
+        )
+        view.verticalHeader().setSectionResizeMode(
+            QtWidgets.QHeaderView.ResizeToContents
+        )
+
+        layout = QtWidgets.QVBoxLayout()
+        layout.setContentsMargins(0, 0, 0, 0)
+        layout.addWidget(view)
 
-        rbv_layout = QtWidgets.QGridLayout()
-        rbv_layout = self.setup_signal_rbvs(self._config, self._db, rbv_layout)
-        self.rbv_frame.setLayout(rbv_layout)
+        return layout
 
-    def setup_tpr_rbvs(self, las_conf, las_db, grid):
+    def setup_tpr_rbvs(self, las_conf, las_db, model):
         """
-        Setup RBV widgets for TPR triggers associated with the laser system.
+        Add rows of RBVs for TPR triggers associated with the laser system.
 
         Arguments
         ---------
         las_conf: The key name of the laser to be used.
         las_db: The file name of the laser happi db.json file
-        grid: The QGridLayout widget to add widgets to
+        model: The ReadbackTableModel to add rows to
         """
-        # Setup column headers
-        desc = pydm_widgets.PyDMLabel()
-        desc.setText("Trigger")
-        grid.addWidget(desc, 0, 0)
-
-        reprate = pydm_widgets.PyDMLabel()
-        reprate.setText("Rep. Rate")
-        grid.addWidget(reprate, 0, 1)
-
-        ratemode = pydm_widgets.PyDMLabel()
-        ratemode.setText("Rate Mode")
-        grid.addWidget(ratemode, 0, 2)
-
-        eventcode = pydm_widgets.PyDMLabel()
-        eventcode.setText("Event Code")
-        grid.addWidget(eventcode, 0, 3)
-
-        width = pydm_widgets.PyDMLabel()
-        width.setText("Width (ns)")
-        grid.addWidget(width, 0, 4)
-
-        delay = pydm_widgets.PyDMLabel()
-        delay.setText("Delay (ns)")
-        grid.addWidget(delay, 0, 5)
-
-        op = pydm_widgets.PyDMLabel()
-        op.setText("Logic")
-        grid.addWidget(op, 0, 6)
-
-        enabled = pydm_widgets.PyDMLabel()
-        enabled.setText("Status")
-        grid.addWidget(enabled, 0, 7)
-
-        # Setup TPR PV RBVs
-        tpr_trigs = las_db.search(device_class='pcdsdevices.tpr.TprTrigger')
-        ntrig = 1
+        tpr_trigs = las_db.search(
+            device_class='pcdsdevices.tpr.TprTrigger', active=True
+        )
         for trig in tpr_trigs:
-            if trig.metadata['active']:
-                name = trig.metadata['name']
-                if name in las_conf['main']['devices'].keys():
-                    trig_conf = las_conf['main']['devices'][name]
-                    rbvs = trig_conf['rbvs']
-                    for nrbv, rbv in enumerate(rbvs):
-                        child = self.configure_rbv_widget(trig, rbv)
-                        grid.addWidget(child, ntrig, nrbv)
-                    ntrig += 1
+            name = trig.metadata['name']
+            if name in las_conf['main']['devices'].keys():
+                trig_conf = las_conf['main']['devices'][name]
+                rbvs = trig_conf['rbvs']
+                model.add_row(
+                    [self.configure_rbv_cell(trig, rbv) for rbv in rbvs]
+                )
 
-        return grid
+        return model
 
-    def setup_signal_rbvs(self, las_conf, las_db, grid):
+    def setup_signal_rbvs(self, las_conf, las_db, model):
         """
-        Setup RBV widgets for TPR triggers associated with the laser system.
+        Add rows of RBVs for signals associated with the laser system.
 
         Arguments
         ---------
         las_conf: The key name of the laser to be used.
         las_db: The file name of the laser happi db.json file
-        grid: The QGridLayout widget to add widgets to
+        model: The ReadbackTableModel to add rows to
         """
-        # Setup column headers
-        desc = pydm_widgets.PyDMLabel()
-        desc.setText("Signal")
-        grid.addWidget(desc, 0, 0)
-
-        val = pydm_widgets.PyDMLabel()
-        val.setText("Value")
-        grid.addWidget(val, 0, 1)
-
-        # Setup Signal PV RBVs
-        signals = las_db.search(device_class='ophyd.signal.EpicsSignal')
-        nsig = 1
+        signals = las_db.search(
+            device_class='ophyd.signal.EpicsSignal', active=True
+        )
         for signal in signals:
-            if signal.metadata['active']:
-                name = signal.metadata['name']
-                if name in las_conf['main']['devices'].keys():
-                    sig_conf = las_conf['main']['devices'][name]
-                    rbvs = sig_conf['rbvs']
-                    for nrbv, rbv in enumerate(rbvs):
-                        child = self.configure_rbv_widget(signal, rbv)
-                        grid.addWidget(child, nsig, nrbv)
-                    nsig += 1
+            name = signal.metadata['name']
+            if name in las_conf['main']['devices'].keys():
+                sig_conf = las_conf['main']['devices'][name]
+                rbvs = sig_conf['rbvs']
+                model.add_row(
+                    [self.configure_rbv_cell(signal, rbv) for rbv in rbvs]
+                )
 
-        return grid
+        return model
 
-    def configure_rbv_widget(self, dev, rbv):
+    def configure_rbv_cell(self, dev, rbv):
         """
-        Setup a ophyd device RBV widget.
+        Setup a ophyd device RBV table cell.
 
         Arguments
         ---------
         dev: happi Client search result
-        rbv: The device class signal to create an RBV widget for
+        rbv: The device class signal to create an RBV cell for
              *Note: in the case of EpicsSignals, we use a "val" to indicate
              that we want to use the base PV of the signal.
 
         returns:
-            PyDMLabel
+            The device name for the 'name' rbv, otherwise a ReadbackCell
         """
-        child = pydm_widgets.PyDMLabel()
-        device = dev.get()
         if rbv == 'name':
-            child.setText(getattr(device, 'name'))
-            return child
+            return dev.metadata['name']
         elif rbv == 'val':  # EpicsSignals need pvname, use "val" in config
-            pvname = getattr(device, "pvname")
+            pvname = get_pvname(dev, None)
         else:
-            pvname = getattr(device, f"{rbv}.pvname")
-        channel = f"ca://{pvname}"
-        child.set_channel(channel)
+            pvname = get_pvname(dev, rbv)
+
+        return ReadbackCell(f"ca://{pvname}")
 
-        return child
+
+class ApplyWorker(QtCore.QThread):
+    """
+    Thread that runs the steps of a configuration Apply in order, reporting
+    progress back to the GUI through Qt signals.
+
+    Arguments
+    ---------
+    steps: List of (status text, function) tuples
+    rollback: Optional function run if a step fails, returning the list of
+              the parts it could not restore
+    timer: Optional ApplyTimer recording the duration of each step
+    parent: Parent QObject
+    """
+    progress = QtCore.Signal(str)
+    failed = QtCore.Signal(str)
+
+    def __init__(self, steps, rollback=None, timer=None, parent=None):
+        super().__init__(parent)
+        self._steps = steps
+        self._rollback = rollback
+        self._timer = timer
+        self.error = None
+
+    def run(self):
+        try:
+            self._run_steps()
+        finally:
+            if self._timer is not None:
+                self._timer.stop()
+
+    def _run_steps(self):
+        for nstep, (text, step) in enumerate(self._steps):
+            self.progress.emit(
+                f"Status: {text} ({nstep + 1}/{len(self._steps)})"
+            )
+            try:
+                with phase(self._timer, "step", text):
+                    step()
+            except Exception as e:
+                logger.exception("Apply step '%s' failed", text)
+                self.error = f"{text}: {e}"
+                if self._rollback is not None:
+                    self.progress.emit("Status: Rolling back...")
+                    try:
+                        with phase(self._timer, "rollback"):
+                            unrestored = self._rollback()
+                        if unrestored:
+                            self.error += (
+                                " (partly rolled back, not restored: "
+                                f"{', '.join(unrestored)})"
+                            )
+                        else:
+                            self.error += " (rolled back)"
+                    except Exception as rollback_error:
+                        logger.exception("Rollback failed")
+                        self.error += f" (rollback failed: {rollback_error})"
+                self.failed.emit(self.error)
+                return
 
 
-class UserConfigDisplay(Display):
+class UserConfigDisplay(CompiledDisplay):
     """
     Class for rep. rate configuration application user display.
     """
@@ -529,8 +672,8 @@ class UserConfigDisplay(Display):
     # Laser Config
     laser_config_widget: LaserConfigDisplay
 
-    # Expert mode widgets
-    expert_display_widget: ExpertDisplay
+    # Expert mode widgets, the ExpertDisplay is built on first use
+    expert_placeholder: QtWidgets.QWidget
     expert_checkbox: QtWidgets.QCheckBox
 
     def __init__(
@@ -542,36 +685,67 @@ class UserConfigDisplay(Display):
     ):
         super().__init__(parent, **kwargs)
 
-        self.laser_config_widget.setup_display(config, debug)
+        self._debug = debug
 
-        self.sc_metadata_widget.setup_display(config, debug)
+        # Parsed once and shared, read-only, by all of the subdisplays
+        self._config = load_config(config)
 
-        self.expert_display_widget.setup_display(config, debug)
+        if self._debug:
+            print(f"Read configuration file: {config}")
+            cfg_keys = list(self._config.keys())
+            print(f"Configuration sections: {cfg_keys}")
+            print(self._config)
 
-        self._debug = debug
+        self.laser_config_widget.setup_display(self._config, debug)
 
-        self._config = read_config(config)
-        if self._config is None:
-            raise ValueError(f"Could not read config file {config}")
+        self.sc_metadata_widget.setup_display(self._config, debug)
 
-        if self._config is not None:
-            self._db = happi.Client(
-                path=self._config['main']['laser_database']
-            )
+        self.expert_display_widget = None
+        # Tear the expert display down again when expert mode is turned off
+        self._expert_teardown = bool(
+            self._config['main'].get('expert_teardown', False)
+        )
+
+        self._db = get_catalog(self._config['main']['laser_database'])
+        # Devices are instantiated on first use and kept connected
+        self._devices = DevicePool()
+        self._devices.sync(self._db)
+        # Only write device settings that differ from the hardware
+        self._write_changed_only = bool(
+            self._config['main'].get('write_changed_only', True)
+        )
+
+        # "Notepad" PVs, created here so they are connected by Apply time
+        notepad_pv = self._config['main']['notepad_pv']
+        self._offset_sig = EpicsSignal(f"{notepad_pv}:SC_BUCKET")
+        self._timestamp_sig = EpicsSignal(f"{notepad_pv}:SC_TIMESTAMP")
 
         self._engine1 = int(self._config['main']['engine1'])
         self._engine2 = int(self._config['main']['engine2'])
         xpm_pv = self._config['main']['xpm_pv']
 
+        # PVA channels to the XPM, kept open for the life of the application
+        self._xpm = get_xpm_channels(xpm_pv)
+
         # Sequence engine for on/off time codes
-        self._LasSeq = SeqUser(f"{xpm_pv}:SEQENG:{self._engine1}")
+        self._LasSeq = self._xpm.sequser(self._engine1)
         # Sequence engine for base laser rate and diagnostic codes
-        self._BaseSeq = SeqUser(f"{xpm_pv}:SEQENG:{self._engine2}")
+        self._BaseSeq = self._xpm.sequser(self._engine2)
+
+        # Compiled sequences, optionally persisted between runs
+        self._seq_cache = SequenceCache(
+            cache_dir=self._config['main'].get('sequence_cache')
+        )
 
         self.screen_title.setText(self._config['main']['title'])
 
         self.update_expert_vis()
 
+        # Per-phase Apply timings, optionally exported for monitoring
+        self._metrics_dir = self._config['main'].get('metrics_dir')
+        self._timer = None
+
+        self._apply_worker = None
         self.laser_config_widget.apply_button.clicked.connect(
             self.apply_config
         )
@@ -586,7 +760,35 @@ class UserConfigDisplay(Display):
         )
 
     def update_expert_vis(self):
-        self.expert_display_widget.set_visibility(self.expert_mode)
+        if self.expert_mode:
+            if self.expert_display_widget is None:
+                self.build_expert_display()
+            self.expert_display_widget.set_visibility(True)
+        elif self.expert_display_widget is not None:
+            if self._expert_teardown:
+                self.teardown_expert_display()
+            else:
+                self.expert_display_widget.set_visibility(False)
+
+    def build_expert_display(self):
+        """
+        Build the expert subdisplay into its placeholder.
+        """
+        self.expert_display_widget = ExpertDisplay(
+            parent=self.expert_placeholder
+        )
+        self.expert_display_widget.setup_display(self._config, self._debug)
+        self.expert_placeholder.layout().addWidget(self.expert_display_widget)
+
+    def teardown_expert_display(self):
+        """
+        Disconnect and delete the expert subdisplay.
+        """
+        widget = self.expert_display_widget
+        self.expert_display_widget = None
+        widget.set_visibility(False)
+        self.expert_placeholder.layout().removeWidget(widget)
+        widget.deleteLater()
 
     @property
     def debug(self):
@@ -596,14 +798,13 @@ class UserConfigDisplay(Display):
     def debug(self, value):
         self._debug = bool(value)
 
+    @property
+    def bay(self):
+        return self._config['main']['bay']
+
     @property
     def db(self):
-        if self.config is not None:
-            self._db = happi.Client(
-                path=self._config['main']['laser_database']
-            )
-            return self._db
-        return None
+        return self._db
 
     @property
     def expert_mode(self):
@@ -628,48 +829,242 @@ class UserConfigDisplay(Display):
         """
         Write the given value into the offset PV for this system.
         """
-        pv = self._config['main']['notepad_pv'] + ':SC_BUCKET'
-        sig = EpicsSignal(pv)
-        sig.put(value)
+        with phase(self._timer, "write_offset"):
+            self._offset_sig.put(value)
 
     def write_timestamp(self):
         """
         Write the current time into the timestamp PV for this system.
         """
-        pv = self._config['main']['notepad_pv'] + ':SC_TIMESTAMP'
-        sig = EpicsSignal(pv)
         t = time.asctime()
-        sig.put(t)
+        with phase(self._timer, "write_timestamp"):
+            self._timestamp_sig.put(t)
+
+    def write_notepad(self, offset):
+        """
+        Write the offset and timestamp notepad PVs as one concurrent pair.
+        """
+        run_concurrently([
+            ("SC_BUCKET", lambda: self.write_offset(offset)),
+            ("SC_TIMESTAMP", self.write_timestamp),
+        ])
 
-    def apply_device_config(self):
+    def device_settings(self, request):
+        """
+        Return the device settings requested by an Apply as a list of
+        (device name, device, attribute, value) tuples. The attribute is None
+        for devices that are signals themselves.
+        """
         supported_devices = [
             "pcdsdevices.tpr.TprTrigger",
             "ophyd.signal.EpicsSignal",
         ]
+        arrival_config = request['arrival_config']
+        requested = []
         for devclass in supported_devices:
             devices = self._db.search(device_class=devclass)
             for device in devices:
                 name = device.metadata['name']
                 if name == "TIC_Averaging":  # Handle this as special case
-                    navg = self.calc_tic_averaging(
-                        self.laser_config_widget.base_rate
-                    )
-                    instance = device.get()
-                    instance.put(navg)
-                elif name in self.laser_config_widget.arrival_config:
-                    instance = device.get()
-                    config = self.laser_config_widget.arrival_config[name]
+                    navg = self.calc_tic_averaging(request['base_rate'])
+                    requested.append((device, None, navg))
+                elif name in arrival_config:
+                    config = arrival_config[name]
                     if devclass == "ophyd.signal.EpicsSignal":
                         if 'val' in config.keys():
-                            instance.put(config['val'])
-                            if self._debug:
-                                print(f"Put {device} {config['val']}")
+                            requested.append((device, None, config['val']))
                         else:
                             raise Exception("Missing 'val' for EpicsSignal")
                     else:
-                        instance.configure(config)
-                        if self._debug:
-                            print(f"Configure {device} {config}")
+                        for attr, value in config.items():
+                            requested.append((device, attr, value))
+
+        # Fetch (or on first use, build and connect) the devices in parallel
+        items = {item.metadata['name']: item for item, _, _ in requested}
+        instances = run_concurrently([
+            (name, self._timed("get_device", self._devices.get, name, item))
+            for name, item in items.items()
+        ])
+
+        return [
+            (item.metadata['name'], instances[item.metadata['name']], attr,
+             value)
+            for item, attr, value in requested
+        ]
+
+    def read_state(self, settings, programs):
+        """
+        Read the current value of every setting, the title of the program
+        loaded in every engine and the SEQCODES descriptions, all in one
+        concurrent batch.
+
+        returns:
+            (list of values, dict of engine --> title, list of descriptions)
+            Values that could not be read are None.
+        """
+        calls = [
+            (f"setting{n}",
+             partial(try_read_setting, setting_signal(device, attr), value))
+            for n, (_, device, attr, value) in enumerate(settings)
+        ]
+        calls += [
+            (f"engine{nengine}", partial(engine_program_title, sequser))
+            for _, _, sequser, nengine in programs
+        ]
+        calls.append(
+            ("SEQCODES",
+             lambda: list(self._xpm.seqcodes.get().value.Description))
+        )
+        with phase(self._timer, "read_state"):
+            results = run_concurrently(calls)
+
+        values = [results[f"setting{n}"] for n in range(len(settings))]
+        titles = {
+            nengine: results[f"engine{nengine}"]
+            for _, _, _, nengine in programs
+        }
+
+        return values, titles, results["SEQCODES"]
+
+    def snapshot_config(self, request, state):
+        """
+        Generate everything this Apply will write and read the values it is
+        about to replace, for change detection and rollback.
+        """
+        state['programs'] = [
+            self.base_rates_program(request),
+            self.laser_rates_program(request),
+        ]
+        state['settings'] = self.device_settings(request)
+        state['notepad'] = [
+            ("SC_BUCKET", self._offset_sig, None, request['offset'])
+        ]
+        values, titles, desc = self.read_state(
+            state['settings'] + state['notepad'], state['programs']
+        )
+        state['previous'] = values
+        state['previous_titles'] = titles
+        state['previous_desc'] = desc
+        state['written'] = []
+
+    def record_writes(self, state, settings, write):
+        """
+        Run write, a batch writing settings, and add the settings it wrote to
+        state['written'], including when some of its calls failed. The batch
+        must name its calls after the settings.
+        """
+        try:
+            write()
+        except BatchError as e:
+            state['written'] += [
+                setting for setting in settings if setting[0] not in e.failed
+            ]
+            raise
+        state['written'] += settings
+
+    def apply_device_config(self, state):
+        """
+        Write the requested goose arrival configuration to the laser devices.
+        All device writes are sent as one concurrent batch.
+        """
+        settings = state['settings']
+        if self._write_changed_only:
+            # Skip settings that already held the value before Apply
+            previous = state['previous'][:len(settings)]
+            settings = [
+                setting for setting, current in zip(settings, previous)
+                if not values_match(current, setting[3])
+            ]
+
+        with phase(self._timer, "apply_device_config"):
+            self.record_writes(
+                state, settings, partial(write_settings, settings, self._timer)
+            )
+
+        if self._debug:
+            for name, _, attr, value in settings:
+                print(f"Set {name} {attr or 'val'} {value}")
+
+    def verify_config(self, state):
+        """
+        Read back the device settings, notepad offset and engine programs in
+        one concurrent batch and compare them with the request.
+        """
+        settings = state['settings'] + state['notepad']
+        values, titles, _ = self.read_state(settings, state['programs'])
+
+        failures = [
+            f"{name} {attr or 'val'}"
+            for (name, _, attr, value), current in zip(settings, values)
+            if not values_match(current, value)
+        ]
+        for _, instrset, _, nengine in state['programs']:
+            if titles[nengine] is None:
+                # Same as when programming: an unreadable title is unknown,
+                # not wrong
+                logger.warning("Could not verify the engine %d program",
+                               nengine)
+            elif titles[nengine] != program_title(instrset):
+                failures.append(f"engine {nengine}")
+        if failures:
+            raise RuntimeError(
+                f"Readback does not match request: {', '.join(failures)}"
+            )
+
+    def rollback_config(self, state):
+        """
+        Restore the values read before Apply started, in parallel. Only the
+        settings this Apply wrote are restored. Engine programs are restored
+        if they can be found in the sequence cache; if one can't, nothing
+        else is restored either, so the XPM programs and device settings
+        always belong to the same configuration.
+
+        returns:
+            List of the parts that were not restored, empty if the rollback
+            was complete
+        """
+        if 'previous' not in state:
+            return []  # Failed before anything was written
+
+        desc = state['previous_desc']
+        programs = []
+        unknown = []
+        for _, _, sequser, nengine in state['programs']:
+            title = state['previous_titles'][nengine]
+            if engine_program_title(sequser) == title:
+                continue  # Not reprogrammed by this Apply
+            previous = self._seq_cache.find(title) if title else None
+            if previous is None:
+                logger.warning("Can't restore engine %d program %s",
+                               nengine, title)
+                unknown.append(f"engine {nengine} program")
+                continue
+            seqdesc = {e: desc[4*nengine+e] for e in range(4)}
+            programs.append((seqdesc, previous, sequser, nengine))
+
+        # Never leave the TIC gate disabled
+        calls = [("TIC", partial(self.set_tic_enable, True))]
+        if unknown:
+            run_concurrently(calls)
+            return unknown + ["device settings (kept to match the XPM)"]
+
+        settings = state['settings'] + state['notepad']
+        previous = dict(zip(
+            ((name, attr) for name, _, attr, _ in settings), state['previous']
+        ))
+        restore = []
+        unread = []
+        for name, device, attr, _ in state['written']:
+            value = previous[(name, attr)]
+            if value is None:
+                unread.append(f"{name} {attr or 'val'} (not read before)")
+            else:
+                restore.append((name, device, attr, value))
+        calls.append(("devices", partial(write_settings, restore)))
+        if programs:
+            calls.append(("XPM", partial(self.write_xpm_config, programs)))
+        run_concurrently(calls)
+        return unread
 
     def calc_tic_averaging(self, total_rate):
         """
@@ -682,80 +1077,106 @@ class UserConfigDisplay(Display):
         sample_size = 200 if rate > 2000 else 100
         return sample_size
 
-    def apply_laser_rates(self):
+    def laser_rates_program(self, request):
         """
-        Generate and apply the XPM configuration for the laser on/off time
-        event codes.
+        Generate the XPM configuration for the laser on/off time event codes.
+
+        returns:
+            (seqdesc, instrset, sequser, engine) tuple for write_xpm_config
         """
-        base_div = 910000//self.laser_config_widget.base_rate
-        if self.laser_config_widget.goose_enabled:
-            goose_div = 910000//self.laser_config_widget.goose_rate
+        base_div = 910000//request['base_rate']
+        if request['goose_rate'] is not None:
+            goose_div = 910000//request['goose_rate']
         else:
             goose_div = None
 
         if self._debug:
-            print("Applying laser rates")
-            print(f"Base rate: {self.laser_config_widget.base_rate}")
-            print(f"Goose rate: {self.laser_config_widget.goose_rate}")
-            print(f"Goose arrival: {self.laser_config_widget.arrival_config}")
+            print("Generating laser rates")
+            print(f"Base rate: {request['base_rate']}")
+            print(f"Goose rate: {request['goose_rate']}")
+            print(f"Goose arrival: {request['arrival_config']}")
             print(f"Base div: {base_div}")
             print(f"Goose div: {goose_div}")
-            print(f"Offset: {self.offset}")
+            print(f"Offset: {request['offset']}")
 
-        instrset = make_sequence(base_div, goose_div, self.offset, self._debug)
+        with phase(self._timer, "laser_rates_program"):
+            instrset = self._seq_cache.laser_sequence(
+                base_div, goose_div, request['offset']
+            )
+        if self._debug:
+            print(f"Laser sequence: {len(instrset)} instructions")
 
         bay = self._config['main']['bay']
         seqdesc = {0: f"{bay} On time shots", 1: f"{bay} Goose shots",
                    2: f"{bay} All laser shots", 3: ""}
 
-        self.write_xpm_config(seqdesc, instrset, self._LasSeq, self._engine1)
+        return seqdesc, instrset, self._LasSeq, self._engine1
 
-    def apply_base_rates(self):
+    def base_rates_program(self, request):
         """
-        Generate and apply the XPM configuration for the "base" laser rates
-        that should always be available.
+        Generate the XPM configuration for the "base" laser rates that should
+        always be available.
+
+        returns:
+            (seqdesc, instrset, sequser, engine) tuple for write_xpm_config
         """
         if self._debug:
-            print("Applying base rates")
-            print(f"Offset: {self.offset}")
+            print("Generating base rates")
+            print(f"Offset: {request['offset']}")
 
-        instrset = make_base_sequence(self.offset)
+        with phase(self._timer, "base_rates_program"):
+            instrset = self._seq_cache.base_sequence(request['offset'])
 
         bay = self._config['main']['bay']
         seqdesc = {0: f"{bay} 910kHz", 1: f"{bay} 32.5kHz", 2: f"{bay} 100Hz",
                    3: f"{bay} 5Hz"}
 
-        self.write_xpm_config(seqdesc, instrset, self._BaseSeq, self._engine2)
+        return seqdesc, instrset, self._BaseSeq, self._engine2
 
-    def write_xpm_config(self, seqdesc, instrset, sequser, nengine):
+    def apply_rates(self, state):
         """
-        Function to write a given XPM configuration to the specified engine.
+        Apply the base rate and laser on/off time XPM configurations
+        generated by snapshot_config.
         """
-        seqcodes_pv = Pv(
-            f"{self._config['main']['xpm_pv']}:SEQCODES", isStruct=True
-        )
-        seqcodes = seqcodes_pv.get()
-        desc = seqcodes.value.Description
+        self.write_xpm_config(state['programs'])
 
-        sequser.execute('title', instrset, None, sync=True, refresh=False)
+    def write_xpm_config(self, programs):
+        """
+        Write XPM configurations to their engines. The SEQCODES descriptions
+        of all engines are updated in one read-modify-write, and all
+        reprogrammed engines are restarted with a single SeqReset so they
+        start in the same cycle.
 
+        Arguments
+        ---------
+        programs: List of (seqdesc, instrset, sequser, engine) tuples
+        """
         engineMask = 0
-        engineMask |= (1 << nengine)
-
-        for e in range(4*nengine, 4*nengine+4):
-            desc[e] = ''
-        for e, d in seqdesc.items():
-            desc[4*nengine+e] = d
+        engine_descs = {}
+        for seqdesc, instrset, sequser, nengine in programs:
+            engine_descs[nengine] = seqdesc
+            # The program title fingerprints the instructions, so an engine
+            # that already runs this program doesn't need an upload or reset.
+            title = program_title(instrset)
+            if engine_program_title(sequser) == title:
+                if self._debug:
+                    print(f"Engine {nengine} already holds {title}")
+                continue
+            with phase(self._timer, "upload_sequence", f"engine {nengine}"):
+                sequser.execute(
+                    title, instrset, None, sync=True, refresh=False
+                )
+            engineMask |= (1 << nengine)
 
         tmo = 5.0  # EPICS PVA timeout
 
-        v = seqcodes.value
-        v.Description = desc
-        seqcodes.value = v
-        seqcodes_pv.put(seqcodes, wait=tmo)
+        with phase(self._timer, "write_seqcodes_desc"), \
+                self._xpm.seqcodes_lock:
+            write_seqcodes_desc(self._xpm.seqcodes, engine_descs, tmo)
 
-        pvSeqReset = Pv(f"{self._config['main']['xpm_pv']}:SeqReset")
-        pvSeqReset.put(engineMask, wait=tmo)
+        if engineMask:
+            with phase(self._timer, "seq_reset"):
+                self._xpm.seq_reset.put(engineMask, wait=tmo)
 
     def set_tic_enable(self, enable):
         """
@@ -769,26 +1190,149 @@ class UserConfigDisplay(Display):
             conf = {'enable_trg_cmd': 'Disabled', 'enable_ch_cmd': 'Disabled'}
 
         trig_names = ['TIC_Gate', 'TIC_Gate_Goose']
-        devices = self._db.search(device_class="pcdsdevices.tpr.TprTrigger")
-        for device in devices:
-            name = device.metadata['name']
-            if name in trig_names:
-                instance = device.get()
-                instance.configure(conf)
+        for name in trig_names:
+            device = self._db.get(name)
+            if device is not None:
+                instance = self._devices.get(device)
+                with phase(self._timer, "set_tic_enable", name):
+                    instance.configure(conf)
 
     def update_status(self, status):
         self.laser_config_widget.status_label.setText(status)
 
+    def apply_request(self):
+        """
+        Collect the requested configuration from the GUI widgets. This has to
+        run in the GUI thread, the apply steps only use the returned dict.
+        """
+        laser = self.laser_config_widget
+        goose_rate = laser.goose_rate if laser.goose_enabled else None
+        return {
+            'base_rate': laser.base_rate,
+            'goose_rate': goose_rate,
+            'arrival_config': laser.arrival_config,
+            'offset': self.offset,
+        }
+
+    def apply_steps(self, request, state):
+        """
+        Return the list of (status text, function) steps that apply the
+        requested configuration to the system. The steps share the state
+        dict, which holds the snapshot used for rollback.
+        """
+        return [
+            ("Reading current settings",
+             lambda: self.snapshot_config(request, state)),
+            ("Disabling TIC", lambda: self.set_tic_enable(False)),
+            ("Programming XPM", lambda: self.apply_rates(state)),
+            ("Configuring devices", lambda: self.apply_device_config(state)),
+            ("Enabling TIC", lambda: self.set_tic_enable(True)),
+            ("Writing notepad PVs",
+             lambda: self.record_writes(
+                 state, state['notepad'],
+                 partial(self.write_notepad, request['offset'])
+             )),
+            ("Verifying", lambda: self.verify_config(state)),
+        ]
+
     def apply_config(self):
         """
-        Apply the requested configuration to the system.
+        Apply the requested configuration to the system. The configuration is
+        applied by a worker thread so the display keeps updating meanwhile.
+        If a step fails, the values read before Apply are restored.
         """
+        if self._apply_worker is not None and self._apply_worker.isRunning():
+            return
+
+        # Pick up edits to the happi database, also when another display
+        # sharing the catalog already reloaded it.
+        self._db.refresh()
+        self._devices.sync(self._db)
+
+        try:
+            request = self.apply_request()
+        except (TypeError, ValueError) as e:
+            self.update_status(f"Status: Invalid request: {e}")
+            return
+
+        self.laser_config_widget.apply_button.setEnabled(False)
         self.update_status("Status: Configuring...")
-        self.set_tic_enable(False)
-        self.apply_base_rates()
-        self.apply_laser_rates()
-        self.apply_device_config()
-        self.set_tic_enable(True)
-        self.write_offset(self.offset)
-        self.write_timestamp()
-        self.update_status("Status: Config Done")
+
+        state = {}
+        self._timer = ApplyTimer(self._config['main']['bay'])
+        self._apply_worker = ApplyWorker(
+            self.apply_steps(request, state),
+            rollback=lambda: self.rollback_config(state),
+            timer=self._timer,
+            parent=self,
+        )
+        self._apply_worker.progress.connect(self.update_status)
+        self._apply_worker.failed.connect(self.apply_failed)
+        self._apply_worker.finished.connect(self.apply_finished)
+        self._apply_worker.start()
+
+    def apply_failed(self, message):
+        self.update_status(f"Status: Config Failed: {message}")
+
+    def apply_finished(self):
+        # Drop the finished worker so one thread isn't kept per Apply
+        worker, self._apply_worker = self._apply_worker, None
+        worker.deleteLater()
+
+        self.laser_config_widget.apply_button.setEnabled(True)
+        if not worker.error:
+            self.update_status("Status: Config Done")
+        self.report_timing(worker.error)
+
+    def report_timing(self, error=None):
+        """
+        Log the phase timings of the last Apply and, if metrics_dir is
+        configured, export them as a JSON log entry and Prometheus text file.
+        """
+        timer = self._timer
+        if timer is None:
+            return
+
+        logger.info("Apply took %.3f s", timer.duration)
+        if self._debug:
+            for (name, target), (seconds, count) in timer.totals().items():
+                label = f"{name} {target}" if target else name
+                print(f"{label}: {seconds:.3f} s ({count} calls)")
+
+        if self._metrics_dir:
+            prefix = timer.name.lower().replace(" ", "_") or "opcpa"
+            export_metrics(self._metrics_dir, prefix, timer, error)
+
+    def _timed(self, name, func, target, *args):
+        """
+        Return a function calling func(*args), timed as the named phase of
+        the current Apply.
+        """
+        func = partial(func, *args)
+        if self._timer is None:
+            return func
+        return self._timer.timed(name, func, target)
+
+
+class MultiBayDisplay(QtWidgets.QTabWidget):
+    """
+    Console with one UserConfigDisplay tab per bay configuration. The bays
+    run in one process, so they share the XPM, SC metadata and happi
+    channels instead of each opening their own.
+
+    Arguments
+    ---------
+    configs: List of bay configuration file paths
+    debug: Debug flag passed to every bay
+    """
+    def __init__(self, parent=None, configs=(), debug=False):
+        super().__init__(parent)
+
+        self.bays = []
+        for config in configs:
+            display = UserConfigDisplay(config=config, debug=debug)
+            self.bays.append(display)
+            self.addTab(display, display.bay)
+
+        bays = ", ".join(display.bay for display in self.bays)
+        self.setWindowTitle(f"OPCPA Rep. Rate Configuration: {bays}")
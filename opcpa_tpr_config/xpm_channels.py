@@ -0,0 +1,56 @@
+"""
+Long-lived PVAccess channels to an XPM, shared for the life of the process.
+
+psdaq's PVAccess modules are only imported once channels are created, so
+importing this module is cheap.
+"""
+import threading
+
+
+class XpmChannels:
+    """
+    Channels used to program the sequence engines of one XPM.
+
+    Arguments
+    ---------
+    xpm_pv: Base PV of the XPM, e.g. "DAQ:NEH:XPM:0"
+    """
+    def __init__(self, xpm_pv):
+        from psdaq.cas.pvedit import Pv
+
+        self.xpm_pv = xpm_pv
+        self.seqcodes = Pv(f"{xpm_pv}:SEQCODES", isStruct=True)
+        self.seq_reset = Pv(f"{xpm_pv}:SeqReset")
+        # Displays sharing this XPM take turns at the SEQCODES
+        # read-modify-write so they don't overwrite each other's descriptions
+        self.seqcodes_lock = threading.Lock()
+        self._sequsers = {}
+        self._lock = threading.Lock()
+
+    def sequser(self, engine):
+        """
+        Return the SeqUser for a sequence engine of this XPM.
+        """
+        engine = int(engine)
+        with self._lock:
+            if engine not in self._sequsers:
+                from psdaq.seq.seqprogram import SeqUser
+
+                self._sequsers[engine] = SeqUser(
+                    f"{self.xpm_pv}:SEQENG:{engine}"
+                )
+            return self._sequsers[engine]
+
+
+_channels = {}
+_channels_lock = threading.Lock()
+
+
+def get_xpm_channels(xpm_pv):
+    """
+    Return the shared XpmChannels for an XPM, opening them on first use.
+    """
+    with _channels_lock:
+        if xpm_pv not in _channels:
+            _channels[xpm_pv] = XpmChannels(xpm_pv)
+        return _channels[xpm_pv]
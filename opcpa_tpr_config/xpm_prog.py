@@ -1,85 +1,139 @@
 import argparse
-import itertools
+import hashlib
 
-import numpy as np
-from psdaq.cas.pvedit import Pv
 from psdaq.seq.seq import Branch, ControlRequest, FixedRateSync
-from psdaq.seq.seqprogram import SeqUser
+from rates import (allowed_goose_rates, carbide_factors, make_base_rates,
+                   make_goose_rate_index)
 
-factors = [2, 2, 2, 2, 5, 5, 5, 5, 7, 13]  # 910,000
-carbide_factors = [1, 2, 2, 5, 5, 5, 5, 13]  # 32,500 (remove 2, 2, 7, add 1)
+# Branch.conditional counters are 12 bits wide, so a single counted loop can
+# repeat its body at most 4096 times (counter value 0 through 4095).
+MAX_LOOP_COUNT = 4096
 
 
-def make_base_rates(laser_factors):
+def format_instruction(instr):
     """
-    Generate a dictionary of factors --> rates (TPG second)
+    Return an instruction as the psdaq call that builds it, e.g.
+    Branch.conditional(line=2, counter=0, value=9).
     """
-    iters = [
-        itertools.combinations(
-            laser_factors, i+1
-        ) for i in range(len(laser_factors))
-    ]
-    f = set()  # Unique set of factors; trims out duplicates
-    for i in iters:
-        for c in i:
-            q = np.prod(np.array(c))
-            f.add(q)
-
-    return sorted(list(f))
+    name = type(instr).__name__
+    args = list(instr.args)[1:]  # args[0] is the opcode
+    if name == "Branch":
+        name += ".conditional" if len(args) > 1 else ".unconditional"
+    keys = {
+        "FixedRateSync": ("marker", "occ"),
+        "ControlRequest": ("word",),
+        "Branch.conditional": ("line", "counter", "value"),
+        "Branch.unconditional": ("line",),
+    }.get(name, ())
+    if len(keys) != len(args):
+        text = ", ".join(repr(arg) for arg in args)
+    else:
+        text = ", ".join(f"{key}={arg!r}" for key, arg in zip(keys, args))
+    return f"{name}({text})"
 
 
-def allowed_goose_rates(base_rate, rate_list):
+def print_program(instrset):
     """
-    Return a dict of allowed goose rates, based on the base rate of the laser
-    and a dictionary of allowed base rates created using make_base_rates().
+    Print a program one numbered instruction per line.
     """
+    for line, instr in enumerate(instrset):
+        print(f"{line:3d}: {format_instruction(instr)}")
 
-    return [rate for rate in rate_list if rate < base_rate]
+
+def make_repeat(instrset, body, count):
+    """
+    Append ``count`` repetitions of the instructions in ``body`` to instrset
+    using Branch.conditional counters rather than unrolling the loop.
+
+    Counts that do not fit in a single counter are split into a nested
+    (counter 0 inside counter 1) loop plus a remainder loop, so the number of
+    instructions appended never depends on ``count``.
+
+    Arguments
+    ---------
+    instrset: The instruction list to append to
+    body: List of the instructions making up the loop body. The body must
+          not contain any branches of its own.
+    count: Number of times to repeat the body
+    """
+    def loop(n, counter):
+        line = len(instrset)
+        instrset.extend(body)
+        if n > 1:
+            instrset.append(
+                Branch.conditional(line=line, counter=counter, value=n-1)
+            )
+        return line
+
+    if count <= 0:
+        return
+    if count <= MAX_LOOP_COUNT:
+        loop(count, 0)
+        return
+
+    outer, remainder = divmod(count, MAX_LOOP_COUNT)
+    if outer > MAX_LOOP_COUNT:
+        raise ValueError(
+            f"Cannot repeat a sequence block {count} times "
+            f"(maximum {MAX_LOOP_COUNT**2})"
+        )
+    line = loop(MAX_LOOP_COUNT, 0)
+    if outer > 1:
+        instrset.append(
+            Branch.conditional(line=line, counter=1, value=outer-1)
+        )
+    if remainder:
+        loop(remainder, 0)
 
 
 # Selected base rate + goose rate --> pulse sequence
 def make_sequence(base_div, goose_div=None, offset=None, debug=False):
+    """
+    Build the laser on/off time sequence for a base rate and optional goose
+    rate, both given as 910 kHz bucket divisors.
+
+    The on time pulses between goose pulses are generated with counted loops
+    (see make_repeat), so the length of the program is constant regardless of
+    the base:goose rate ratio. With debug set, the program is printed.
+    """
     # Do some setup
     instrset = []
 
     # Insert bucket offset if it is present
     if offset is not None and offset != 0:
         instrset.append(FixedRateSync(marker="910kH", occ=offset))
-        if debug:
-            print(f"FixedRateSync(marker=\"910kH\", occ={offset})")
+
+    start = len(instrset)
 
     # If we're goosing, put that pulse in _first_ because it makes delay
     # management easier
     if goose_div not in (None, 0):  # Start with goose
         instrset.append(ControlRequest([1, 2]))
         instrset.append(FixedRateSync(marker="910kH", occ=base_div))
-        if debug:
-            print("ControlRequest([1, 2])")
-            print(f"FixedRateSync(marker=\"910kH\", occ={base_div})")
 
     # Loop over base:goose rate ratio once. Because we're using divisors,
     # we divide goose divider by base divider, rather than base rate by
     # goose rate.
     if goose_div in (None, 0):
         n = 1
+    elif goose_div % base_div != 0:
+        raise ValueError(
+            f"Goose divider {goose_div} is not a multiple of base divider "
+            f"{base_div}"
+        )
     else:
         n = (goose_div//base_div) - 1
-    for i in range(n):
-        instrset.append(ControlRequest([0, 2]))
-        instrset.append(FixedRateSync(marker="910kH", occ=base_div))
-        if debug:
-            print("ControlRequest([0, 2])")
-            print(f"FixedRateSync(marker=\"910kH\", occ={base_div})")
+    body = [
+        ControlRequest([0, 2]),
+        FixedRateSync(marker="910kH", occ=base_div),
+    ]
+    make_repeat(instrset, body, n)
 
-    # Change branching based on offset
-    if offset is not None and offset != 0:
-        if debug:
-            print("Branch.unconditional(1)")
-        instrset.append(Branch.unconditional(1))
-    else:
-        if debug:
-            print("Branch.unconditional(0)")
-        instrset.append(Branch.unconditional(0))
+    # Branch back to the start of the pattern, skipping the offset
+    instrset.append(Branch.unconditional(start))
+
+    if debug:
+        print_program(instrset)
 
     return instrset
 
@@ -131,6 +185,68 @@ def make_base_sequence(offset=None):
     return instrset
 
 
+def program_title(instrset):
+    """
+    Return a sequence title that fingerprints the program, so that the
+    program loaded in an engine can be identified by reading back its title.
+    """
+    text = ";".join(
+        f"{type(instr).__name__}{tuple(instr.args)}" for instr in instrset
+    )
+    digest = hashlib.sha1(text.encode()).hexdigest()[:16]
+    return f"opcpa {digest}"
+
+
+def engine_program_title(sequser):
+    """
+    Read back the title of the program loaded in a SeqUser's engine. Returns
+    None if it cannot be read or the engine is not running.
+    """
+    try:
+        running = getattr(sequser, "running", None)
+        if running is not None and not running.get():
+            return None
+        return sequser.seqname.get()
+    except Exception:
+        return None
+
+
+def write_seqcodes_desc(seqcodes_pv, engine_descs, timeout=5.0):
+    """
+    Replace the SEQCODES descriptions of the four event codes of one or more
+    engines in a single read-modify-write, skipping the put if they already
+    match.
+
+    Arguments
+    ---------
+    seqcodes_pv: The XPM SEQCODES Pv
+    engine_descs: Dict of engine number --> {code index: description}
+    timeout: PVA put timeout
+
+    returns:
+        True if the descriptions were written
+    """
+    seqcodes = seqcodes_pv.get()
+    desc = seqcodes.value.Description
+    current = list(desc)
+
+    for nengine, seqdesc in engine_descs.items():
+        for e in range(4*nengine, 4*nengine+4):
+            desc[e] = ''
+        for e, d in seqdesc.items():
+            desc[4*nengine+e] = d
+
+    if list(desc) == current:
+        return False
+
+    v = seqcodes.value
+    v.Description = desc
+    seqcodes.value = v
+    seqcodes_pv.put(seqcodes, wait=timeout)
+
+    return True
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
 
@@ -143,6 +259,14 @@ if __name__ == "__main__":
         help="Desired laser goose rate (sub-harmonic of base_rate)")
     parser.add_argument("offset", help="Desired 910 kHz bucket offset")
     parser.add_argument("bay", help="Laser bay to program for (2 or 3)")
+    parser.add_argument(
+        "--cache-dir",
+        help="Directory of precompiled sequences to reuse between runs"
+    )
+    parser.add_argument(
+        "-n", "--dry-run", action='store_true',
+        help="Validate and print the sequence without connecting to the XPM"
+    )
 
     args = parser.parse_args()
 
@@ -168,7 +292,9 @@ if __name__ == "__main__":
         )
 
     # Dict will eventually be applied to drop down menu
-    goose_list = allowed_goose_rates(base_rate, base_list)
+    goose_list = allowed_goose_rates(
+        base_rate, make_goose_rate_index(base_list)
+    )
 
     if goose_rate not in goose_list:
         raise ValueError(
@@ -179,31 +305,41 @@ if __name__ == "__main__":
     seqdesc = {0: f"Bay {bay} On Time", 1: f"Bay {bay} Off Time", 2: "", 3: ""}
     base_div = 910000//int(base_rate)
     goose_div = 910000//int(goose_rate)
-    inst = make_sequence(base_div, goose_div, offset, True)
+    if args.cache_dir is not None:
+        from seq_cache import SequenceCache
+        inst = SequenceCache(cache_dir=args.cache_dir).laser_sequence(
+            base_div, goose_div, offset
+        )
+    else:
+        inst = make_sequence(base_div, goose_div, offset)
+
+    print_program(inst)
+
+    if args.dry_run:
+        print(f"{program_title(inst)}: {len(inst)} instructions")
+        raise SystemExit(0)
+
+    # Only needed to talk to the XPM, which a dry run never does
+    from xpm_channels import get_xpm_channels
 
     xpm_pv = "DAQ:NEH:XPM:0"
-    seqcodes_pv = Pv(f'{xpm_pv}:SEQCODES', isStruct=True)
-    seqcodes = seqcodes_pv.get()
-    desc = seqcodes.value.Description
+    xpm = get_xpm_channels(xpm_pv)
 
     engine = int(engines[bay])
-    seq = SeqUser(f'{xpm_pv}:SEQENG:{engine}')
-    seq.execute('title', inst, None, sync=True, refresh=False)
+    seq = xpm.sequser(engine)
+    title = program_title(inst)
+    loaded = engine_program_title(seq) == title
+    if loaded:
+        print(f"Engine {engine} already holds {title}, skipping upload")
+    else:
+        seq.execute(title, inst, None, sync=True, refresh=False)
 
     engineMask = 0
     engineMask |= (1 << engine)
 
-    for e in range(4*engine, 4*engine+4):
-        desc[e] = ''
-    for e, d in seqdesc.items():
-        desc[4*engine+e] = d
-
     tmo = 5.0  # epics pva timeout
 
-    v = seqcodes.value
-    v.Description = desc
-    seqcodes.value = v
-    seqcodes_pv.put(seqcodes, wait=tmo)
+    write_seqcodes_desc(xpm.seqcodes, {engine: seqdesc}, tmo)
 
-    pvSeqReset = Pv(f'{xpm_pv}:SeqReset')
-    pvSeqReset.put(engineMask, wait=tmo)
+    if not loaded:
+        xpm.seq_reset.put(engineMask, wait=tmo)